@@ -0,0 +1,259 @@
+"""Linha de comando da pipeline FIPE, sem Streamlit nem Plotly.
+
+Exemplos::
+
+    python -m app.cli importar --limite 2000 --modo estratificado --workers 20
+    python -m app.cli importar --limite 5000 --prazo 300
+    python -m app.cli coletar --limite 500 --saida coleta.csv
+    python -m app.cli carregar coleta.csv --batch-size 500
+    python -m app.cli replay
+    python -m app.cli backfill --meses 24 --meses-paralelos 4
+    python -m app.cli curvas
+    python -m app.cli cache stats
+    python -m app.cli sintetico --linhas 1000000 --saida dados/fipe_1m.pkl
+
+Cada comando escreve um resumo JSON em stdout; os logs vao para stderr e
+para o arquivo JSON-lines configurado em ``app.utils.funcoes``.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+
+def _salvar_arquivo(df, caminho):
+    caminho = Path(caminho)
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    if caminho.suffix == ".json":
+        df.to_json(caminho, orient="records", force_ascii=False)
+    elif caminho.suffix == ".jsonl":
+        df.to_json(caminho, orient="records", lines=True, force_ascii=False)
+    else:
+        df.to_csv(caminho, index=False)
+
+
+def _ler_arquivo(caminho):
+    import pandas as pd
+
+    caminho = Path(caminho)
+    textos = {coluna: str for coluna in ("codigo_fipe", "codigo_marca", "codigo_modelo", "codigo_ano")}
+    if caminho.suffix == ".json":
+        return pd.read_json(caminho, orient="records", dtype=textos)
+    if caminho.suffix == ".jsonl":
+        return pd.read_json(caminho, orient="records", lines=True, dtype=textos)
+    return pd.read_csv(caminho, dtype=textos)
+
+
+def cmd_coletar(args):
+    from app.pipeline.fipe_import import coletar_dados_fipe
+    from app.utils.funcoes import contexto_execucao
+
+    with contexto_execucao("coletar") as run_id:
+        df = coletar_dados_fipe(
+            args.limite,
+            modo=args.modo,
+            cota_por_marca=args.cota_por_marca,
+            pular_conhecidos=args.pular_conhecidos,
+            max_workers=args.workers,
+            prazo_segundos=args.prazo,
+        )
+        if args.saida:
+            _salvar_arquivo(df, args.saida)
+    return {
+        "run_id": run_id,
+        "collected": len(df),
+        "skipped": df.attrs.get("skipped", 0),
+        "deadline_reached": df.attrs.get("deadline_reached", False),
+        "output": args.saida,
+    }
+
+
+def cmd_carregar(args):
+    from app.pipeline.fipe_import import salvar_no_banco
+    from app.pipeline.depreciacao import atualizar_curvas_depreciacao
+    from app.utils.funcoes import contexto_execucao
+
+    with contexto_execucao("carregar") as run_id:
+        df = _ler_arquivo(args.arquivo)
+        summary = salvar_no_banco(df, batch_size=args.batch_size)
+        summary["run_id"] = run_id
+        if not args.sem_analises and not df.empty:
+            summary["curves"] = atualizar_curvas_depreciacao(df)
+    return summary
+
+
+def cmd_importar(args):
+    from app.pipeline.fipe_import import importar_dados_fipe
+
+    return importar_dados_fipe(
+        args.limite,
+        modo=args.modo,
+        cota_por_marca=args.cota_por_marca,
+        max_workers=args.workers,
+        batch_size=args.batch_size,
+        prazo_segundos=args.prazo,
+    )
+
+
+def cmd_replay(args):
+    from app.pipeline.fipe_import import importar_dados_do_cache
+
+    return importar_dados_do_cache(batch_size=args.batch_size)
+
+
+def cmd_backfill(args):
+    from app.pipeline.backfill import executar_backfill
+
+    return executar_backfill(
+        meses=args.meses,
+        referencias=args.referencias,
+        meses_paralelos=args.meses_paralelos,
+        workers_por_mes=args.workers_por_mes,
+        limite_por_mes=args.limite_por_mes,
+    )
+
+
+def cmd_curvas(args):
+    from app.pipeline.depreciacao import atualizar_curvas_depreciacao
+    from app.utils.funcoes import configurar_logging, contexto_execucao
+
+    configurar_logging()
+    with contexto_execucao("curvas") as run_id:
+        return {"run_id": run_id, "curves": atualizar_curvas_depreciacao()}
+
+
+def cmd_cache(args):
+    from app.pipeline.fipe_import import compactar_cache, estatisticas_cache
+
+    if args.acao == "compactar":
+        return compactar_cache()
+    return estatisticas_cache()
+
+
+def cmd_sintetico(args):
+    from app.pipeline.sintetico import carregar_sinteticos_no_banco, gerar_dados_sinteticos, salvar_snapshot
+
+    df = gerar_dados_sinteticos(args.linhas, seed=args.seed)
+    if args.saida:
+        salvar_snapshot(df, args.saida)
+    else:
+        carregar_sinteticos_no_banco(df)
+    return {
+        "rows": len(df),
+        "models": df["codigo_fipe"].nunique(),
+        "brands": df["marca"].nunique(),
+        "output": args.saida or "fipe_carros",
+    }
+
+
+def _adicionar_opcoes_coleta(parser):
+    parser.add_argument("--limite", type=int, default=int(os.getenv("RECORDS_LIMIT", "600")),
+                        help="Quantidade maxima de registros coletados")
+    parser.add_argument("--modo", choices=["sequencial", "estratificado"],
+                        help="Ordem de coleta (padrao: FIPE_COLLECT_MODE)")
+    parser.add_argument("--cota-por-marca", type=int,
+                        help="Maximo de detalhes por marca no modo estratificado")
+    parser.add_argument("--workers", type=int,
+                        help="Threads de requisicao a API (padrao: FIPE_MAX_WORKERS)")
+    parser.add_argument("--prazo", type=float,
+                        help="Tempo maximo em segundos; grava o que foi coletado ate la (padrao: FIPE_TIME_BUDGET)")
+
+
+def _adicionar_opcao_batch(parser):
+    parser.add_argument("--batch-size", type=int,
+                        help="Tamanho inicial do batch de gravacao (padrao: FIPE_SAVE_BATCH_SIZE)")
+
+
+def criar_parser():
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Pipeline FIPE sem interface grafica.")
+    parser.add_argument("--quiet", action="store_true", help="Mostra apenas avisos e erros no stderr")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    coletar = subparsers.add_parser("coletar", help="Coleta da API e grava em arquivo, sem tocar no banco")
+    _adicionar_opcoes_coleta(coletar)
+    coletar.add_argument("--saida", help="Arquivo de saida (.csv, .json ou .jsonl)")
+    coletar.add_argument("--pular-conhecidos", action="store_true",
+                         help="Le do banco os veiculos ja gravados e nao consulta seus detalhes")
+    coletar.set_defaults(func=cmd_coletar)
+
+    carregar = subparsers.add_parser("carregar", help="Grava no banco um arquivo gerado por 'coletar'")
+    carregar.add_argument("arquivo")
+    _adicionar_opcao_batch(carregar)
+    carregar.add_argument("--sem-analises", action="store_true",
+                          help="Nao recalcula as curvas de depreciacao")
+    carregar.set_defaults(func=cmd_carregar)
+
+    importar = subparsers.add_parser("importar", help="Coleta da API e grava no banco")
+    _adicionar_opcoes_coleta(importar)
+    _adicionar_opcao_batch(importar)
+    importar.set_defaults(func=cmd_importar)
+
+    replay = subparsers.add_parser("replay", help="Reconstroi o banco a partir do cache, sem chamadas HTTP")
+    _adicionar_opcao_batch(replay)
+    replay.set_defaults(func=cmd_replay)
+
+    backfill = subparsers.add_parser("backfill", help="Carrega meses de referencia anteriores em fipe_carros_historico")
+    backfill.add_argument("--meses", type=int, default=12, help="Quantidade de meses mais recentes")
+    backfill.add_argument("--referencias", type=int, nargs="+",
+                          help="Codigos de referencia especificos (substitui --meses)")
+    backfill.add_argument("--meses-paralelos", type=int,
+                          help="Meses processados ao mesmo tempo (padrao: FIPE_BACKFILL_MONTHS_PARALLEL)")
+    backfill.add_argument("--workers-por-mes", type=int,
+                          help="Requisicoes de detalhe simultaneas por mes (padrao: FIPE_BACKFILL_WORKERS_PER_MONTH)")
+    backfill.add_argument("--limite-por-mes", type=int, help="Maximo de registros por mes")
+    backfill.set_defaults(func=cmd_backfill)
+
+    curvas = subparsers.add_parser("curvas", help="Recalcula todas as curvas de depreciacao")
+    curvas.set_defaults(func=cmd_curvas)
+
+    cache = subparsers.add_parser("cache", help="Estatisticas e compactacao do cache da API")
+    cache.add_argument("acao", choices=["stats", "compactar"])
+    cache.set_defaults(func=cmd_cache)
+
+    sintetico = subparsers.add_parser("sintetico", help="Gera dados sinteticos para testes de carga do dashboard")
+    sintetico.add_argument("--linhas", type=int, default=1_000_000)
+    sintetico.add_argument("--seed", type=int, default=42)
+    sintetico.add_argument("--saida", help="Snapshot (.pkl ou .csv); sem esta opcao grava em fipe_carros")
+    sintetico.set_defaults(func=cmd_sintetico)
+
+    return parser
+
+
+def main(argv=None):
+    args = criar_parser().parse_args(argv)
+    if args.quiet:
+        os.environ["FIPE_LOG_CONSOLE_LEVEL"] = "WARNING"
+
+    inicio = time.perf_counter()
+    try:
+        resultado = args.func(args)
+        codigo_saida = 0
+    except Exception as e:
+        from app.utils.funcoes import configurar_logging
+
+        configurar_logging()
+        logging.getLogger("fipe").exception("Comando %s falhou", args.comando)
+        resultado = {"error": f"{type(e).__name__}: {e}"}
+        codigo_saida = 1
+    finally:
+        from app.db.engine import dispose_engine
+
+        dispose_engine()
+
+    resultado = {
+        "command": args.comando,
+        "ok": codigo_saida == 0,
+        "elapsed_s": round(time.perf_counter() - inicio, 3),
+        **resultado,
+    }
+    json.dump(resultado, sys.stdout, ensure_ascii=False, default=str)
+    sys.stdout.write("\n")
+    return codigo_saida
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from app.dashboard.filters import filter_data
+
+HLL_PRECISION = 14
+STRATUM_COLUMNS = ["marca", "combustivel", "ano_modelo"]
+
+
+def _bit_length(values):
+    values = values.copy()
+    lengths = np.zeros(values.shape, dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        large = values >= np.uint64(1) << np.uint64(shift)
+        lengths[large] += shift
+        values[large] >>= np.uint64(shift)
+    return lengths + (values > 0)
+
+
+def hll_positions(values, precision=HLL_PRECISION):
+    """Registrador e rank HyperLogLog de cada valor (hash de 64 bits)."""
+    hashes = pd.util.hash_array(np.asarray(values, dtype=object))
+    width = 64 - precision
+    registers = (hashes >> np.uint64(width)).astype(np.int64)
+    remainder = hashes & np.uint64((1 << width) - 1)
+    ranks = (width + 1 - _bit_length(remainder)).astype(np.uint8)
+    return registers, ranks
+
+
+def hll_estimate(registers, precision=HLL_PRECISION):
+    m = 1 << precision
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.exp2(-registers.astype(np.float64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros:
+        return m * math.log(m / zeros)
+    return estimate
+
+
+def hll_relative_error(precision=HLL_PRECISION):
+    return 1.04 / math.sqrt(1 << precision)
+
+
+class KpiSketch:
+    """Resumo dos KPIs por estrato (marca, combustivel, ano modelo).
+
+    Como os filtros do dashboard selecionam estratos inteiros, contagem, soma
+    e maximo de preco por estrato respondem registros, preco medio e maior
+    preco sem varrer as linhas. Modelos distintos nao somam entre estratos, entao
+    cada estrato guarda um HyperLogLog esparso (registrador -> rank) e a selecao
+    usa a uniao dos sketches, com erro relativo de ``hll_relative_error``.
+    """
+
+    def __init__(self, df, precision=HLL_PRECISION):
+        self.precision = precision
+        grouped = df.groupby(STRATUM_COLUMNS, observed=True)
+        self.strata = grouped["valor"].agg(records="size", total="sum", max_price="max").reset_index()
+
+        registers, ranks = hll_positions(df["modelo"], precision)
+        sparse = (
+            pd.DataFrame({"stratum": grouped.ngroup().to_numpy(), "register": registers, "rank": ranks})
+            .groupby(["stratum", "register"], as_index=False)["rank"]
+            .max()
+        )
+        self._stratum = sparse["stratum"].to_numpy()
+        self._register = sparse["register"].to_numpy()
+        self._rank = sparse["rank"].to_numpy()
+
+    def distinct_models(self, strata_ids):
+        selected = np.isin(self._stratum, strata_ids)
+        registers = np.zeros(1 << self.precision, dtype=np.uint8)
+        np.maximum.at(registers, self._register[selected], self._rank[selected])
+        return hll_estimate(registers, self.precision)
+
+    def kpis(self, brands, fuels, years):
+        selected = filter_data(self.strata, brands, fuels, years)
+        records = int(selected["records"].sum())
+        return {
+            "total_records": records,
+            "avg_price": selected["total"].sum() / records if records else float("nan"),
+            "max_price": selected["max_price"].max(),
+            "brands_count": selected["marca"].nunique(),
+            "models_count": round(self.distinct_models(selected.index.to_numpy())) if records else 0,
+            "models_error": hll_relative_error(self.precision),
+        }
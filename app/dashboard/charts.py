@@ -80,3 +80,21 @@ def price_distribution(df):
         color_discrete_sequence=[COLOR_SEQUENCE[5]],
     )
     return apply_chart_layout(fig, 340)
+
+
+def depreciation_curves(curves):
+    fig = px.line(
+        curves,
+        x="anos_de_uso",
+        y="retencao_acumulada",
+        color="serie",
+        markers=True,
+        labels={
+            "anos_de_uso": "Anos de uso",
+            "retencao_acumulada": "Valor retido",
+            "serie": "",
+        },
+        color_discrete_sequence=COLOR_SEQUENCE,
+    )
+    fig.update_layout(yaxis={"tickformat": ".0%"}, legend={"orientation": "h", "y": -0.2})
+    return apply_chart_layout(fig, 400)
@@ -1,20 +1,40 @@
+import os
 import sys
+import time
 from pathlib import Path
 
 import pandas as pd
 import streamlit as st
+from sqlalchemy.exc import SQLAlchemyError
 
 PROJECT_ROOT = Path(__file__).resolve().parents[2]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
+from app.dashboard.approx import KpiSketch
 from app.dashboard.charts import (
+    depreciation_curves,
     price_by_brand,
     price_by_fuel,
     price_by_year,
     price_distribution,
 )
-from app.dashboard.queries import get_engine, load_fipe_data, table_exists
+from app.dashboard.figure_cache import FigureCache, filter_signature
+from app.dashboard.filters import filter_by_brands, filter_by_fuels_and_years, prepare_data
+from app.dashboard.queries import (
+    get_data_version,
+    get_depreciation_version,
+    get_engine,
+    has_trigram_support,
+    load_depreciation_curves,
+    load_fipe_data,
+    search_models,
+)
+from app.dashboard.search import ModelSearchIndex
+
+DATA_VERSION_TTL = int(os.getenv("FIPE_DATA_VERSION_TTL", "15"))
+FIGURE_CACHE_SIZE = int(os.getenv("FIPE_FIGURE_CACHE_SIZE", "256"))
+APPROX_THRESHOLD = int(os.getenv("FIPE_APPROX_THRESHOLD", "1000000"))
 
 
 st.set_page_config(
@@ -28,12 +48,46 @@ def cached_engine():
     return get_engine()
 
 
-@st.cache_data(ttl=300, show_spinner="Carregando dados da FIPE...")
-def cached_data():
-    engine = cached_engine()
-    if not table_exists(engine):
+@st.cache_resource(show_spinner=False)
+def shared_figure_cache():
+    return FigureCache(FIGURE_CACHE_SIZE)
+
+
+@st.cache_data(ttl=DATA_VERSION_TTL, show_spinner=False)
+def cached_data_version():
+    return get_data_version(cached_engine())
+
+
+@st.cache_data(max_entries=2, show_spinner="Carregando dados da FIPE...")
+def cached_data(data_version):
+    if data_version is None:
         return pd.DataFrame()
-    return load_fipe_data(engine)
+    return prepare_data(load_fipe_data(cached_engine()))
+
+
+@st.cache_data(ttl=DATA_VERSION_TTL, show_spinner=False)
+def cached_depreciation_version():
+    return get_depreciation_version(cached_engine())
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_depreciation_curves(depreciation_version, marca):
+    return load_depreciation_curves(cached_engine(), marca)
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_trigram_support():
+    return has_trigram_support(cached_engine())
+
+
+@st.cache_resource(max_entries=2, show_spinner="Preparando KPIs aproximados...")
+def cached_kpi_sketch(data_version):
+    return KpiSketch(cached_data(data_version))
+
+
+@st.cache_resource(max_entries=2, show_spinner="Indexando modelos...")
+def cached_search_index(data_version):
+    return ModelSearchIndex(cached_data(data_version))
 
 
 def format_currency(value):
@@ -42,6 +96,14 @@ def format_currency(value):
     return f"R$ {value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
 
+def format_count(value, error=0.0):
+    text = f"{value:,}".replace(",", ".")
+    if error:
+        margin = f"{error * 100:.1f}".replace(".", ",")
+        return f"~{text} &plusmn;{margin}%"
+    return text
+
+
 def render_page_style():
     st.markdown(
         """
@@ -102,6 +164,12 @@ def render_page_style():
                 letter-spacing: 0;
             }
 
+            .kpi-detail {
+                color: #64748b;
+                font-size: 0.8rem;
+                margin-top: 0.3rem;
+            }
+
             .section-title {
                 color: #0f172a;
                 font-size: 1.05rem;
@@ -133,12 +201,14 @@ def render_header():
     )
 
 
-def render_kpi(label, value):
+def render_kpi(label, value, detail=None):
+    detail_html = f'<div class="kpi-detail">{detail}</div>' if detail else ""
     st.markdown(
         f"""
         <div class="kpi-card">
             <div class="kpi-label">{label}</div>
             <div class="kpi-value">{value}</div>
+            {detail_html}
         </div>
         """,
         unsafe_allow_html=True,
@@ -150,7 +220,7 @@ def render_pipeline_summary(summary):
         return
 
     st.markdown('<div class="section-title">Resumo da ultima execucao</div>', unsafe_allow_html=True)
-    col1, col2, col3, col4 = st.columns(4)
+    col1, col2, col3, col4, col5 = st.columns(5)
     with col1:
         render_kpi("Coletados", f"{summary.get('collected', 0):,}".replace(",", "."))
     with col2:
@@ -159,6 +229,18 @@ def render_pipeline_summary(summary):
         render_kpi("Novos inseridos", f"{summary.get('inserted', 0):,}".replace(",", "."))
     with col4:
         render_kpi("Ja existentes", f"{summary.get('existing', 0):,}".replace(",", "."))
+    with col5:
+        render_kpi("Em quarentena", f"{summary.get('quarantined', 0):,}".replace(",", "."))
+
+    if summary.get("skipped"):
+        st.caption(
+            f"{summary['skipped']:,}".replace(",", ".")
+            + " veiculos ja gravados foram pulados sem consultar a API."
+        )
+    if summary.get("deadline_reached"):
+        st.caption("A coleta foi encerrada pelo tempo maximo; os registros coletados ate o prazo foram gravados.")
+    if summary.get("curves_deferred"):
+        st.caption("As curvas de depreciacao ficaram para depois: rode `python -m app.cli curvas` para atualiza-las.")
 
 
 def pipeline_progress_ratio(update):
@@ -168,13 +250,17 @@ def pipeline_progress_ratio(update):
 
     if event == "start":
         return 0.02
-    if event in {"collect_start", "brand", "records", "collect_limit", "collect_done"}:
+    if event in {"collect_start", "brand", "records", "collect_limit", "collect_deadline", "collect_done"}:
         return min(0.78, 0.08 + (current / total) * 0.70)
     if event == "save_start":
         return 0.82
     if event == "save_batch":
-        return min(0.97, 0.82 + (current / total) * 0.15)
-    if event in {"save_done", "done"}:
+        return min(0.95, 0.82 + (current / total) * 0.13)
+    if event == "save_done":
+        return 0.96
+    if event in {"analytics_start", "analytics_done", "analytics_error"}:
+        return 0.98
+    if event == "done":
         return 1.0
     return 0.5
 
@@ -189,7 +275,7 @@ def apply_filters(df):
         brands = sorted(df["marca"].dropna().unique())
         selected_brands = st.multiselect("Marca", brands, default=brands)
 
-        base = df[df["marca"].isin(selected_brands)] if selected_brands else df
+        base = filter_by_brands(df, selected_brands)
 
         fuels = sorted(base["combustivel"].dropna().unique())
         selected_fuels = st.multiselect("Combustivel", fuels, default=fuels)
@@ -200,11 +286,41 @@ def apply_filters(df):
 
         max_rows = st.number_input("Linhas na tabela", min_value=10, max_value=500, value=100, step=10)
 
-    filtered = base[
-        base["combustivel"].isin(selected_fuels)
-        & base["ano_modelo"].between(selected_years[0], selected_years[1])
-    ]
-    return filtered, max_rows
+    filtered = filter_by_fuels_and_years(base, selected_fuels, selected_years)
+    return filtered, max_rows, (selected_brands, selected_fuels, selected_years)
+
+
+def compute_kpis(filtered):
+    return {
+        "total_records": len(filtered),
+        "avg_price": filtered["valor"].mean(),
+        "max_price": filtered["valor"].max(),
+        "brands_count": filtered["marca"].nunique(),
+        "models_count": filtered["modelo"].nunique(),
+        "models_error": 0.0,
+    }
+
+
+def approximate_kpis_enabled(df):
+    with st.sidebar:
+        return st.toggle(
+            "KPIs aproximados",
+            value=len(df) >= APPROX_THRESHOLD,
+            help=(
+                "Calcula os indicadores a partir de um resumo por marca, combustivel e ano, sem varrer "
+                "os registros filtrados. So a contagem de modelos e estimada (HyperLogLog); desligue "
+                "para o valor exato."
+            ),
+        )
+
+
+def render_figure_cache_stats(figure_cache):
+    stats = figure_cache.stats()
+    with st.sidebar:
+        st.caption(
+            f"Cache de graficos: {stats['size']}/{stats['maxsize']} entradas, "
+            f"{stats['hit_ratio']:.0%} de acertos"
+        )
 
 
 def render_pipeline_action():
@@ -222,6 +338,25 @@ def render_pipeline_action():
                 step=10,
                 help="Controla quantos registros a coleta vai buscar antes de encerrar.",
             )
+            mode = st.selectbox(
+                "Modo de coleta",
+                ["estratificado", "sequencial"],
+                help=(
+                    "Estratificado intercala marcas e modelos para cobrir mais marcas com o mesmo limite; "
+                    "sequencial percorre as marcas em ordem alfabetica."
+                ),
+            )
+            time_budget = st.number_input(
+                "Tempo maximo (s)",
+                min_value=0,
+                max_value=3600,
+                value=0,
+                step=30,
+                help=(
+                    "Encerra a coleta no prazo e grava o que ja foi coletado, priorizando o que esta em cache. "
+                    "Use 0 para coletar ate o limite de registros."
+                ),
+            )
             run_pipeline = st.button("Iniciar coleta", type="primary", use_container_width=True)
 
         with info_col:
@@ -249,8 +384,13 @@ def render_pipeline_action():
             log_output.code("\n".join(logs[-18:]), language="text")
 
         with st.status("Pipeline em execucao", expanded=True) as status:
-            summary = importar_dados_fipe(limite_registros=int(limit), progress_callback=on_progress)
-            st.cache_data.clear()
+            summary = importar_dados_fipe(
+                limite_registros=int(limit),
+                progress_callback=on_progress,
+                modo=mode,
+                prazo_segundos=int(time_budget) or None,
+            )
+            cached_data_version.clear()
             status.update(label="Pipeline concluido", state="complete")
 
         st.success("Coleta concluida. Os dados foram atualizados no banco.")
@@ -258,6 +398,61 @@ def render_pipeline_action():
         st.caption("Recarregue a pagina ou altere algum filtro para atualizar os graficos com os dados mais recentes.")
 
 
+def render_depreciation(filtered):
+    st.markdown('<div class="section-title">Curvas de depreciacao</div>', unsafe_allow_html=True)
+    brands = sorted(filtered["marca"].dropna().unique())
+    brand = st.selectbox("Marca", brands, key="depreciation_brand")
+    curves = cached_depreciation_curves(cached_depreciation_version(), brand)
+    if curves.empty:
+        st.info("As curvas de depreciacao sao calculadas ao final de cada coleta.")
+        return
+
+    brand_curve = curves[curves["nivel"] == "marca"].assign(serie=f"{brand} (mediana da marca)")
+    model_curves = curves[curves["nivel"] == "modelo"]
+    models = sorted(model_curves["modelo"].unique())
+    selected_models = st.multiselect("Modelos", models, default=models[:3], max_selections=6)
+    model_curves = model_curves[model_curves["modelo"].isin(selected_models)].assign(
+        serie=lambda frame: frame["modelo"]
+    )
+
+    st.plotly_chart(
+        depreciation_curves(pd.concat([brand_curve, model_curves], ignore_index=True)),
+        use_container_width=True,
+    )
+    st.caption(
+        "Valor retido: preco medio de cada ano-modelo em relacao ao ano-modelo mais novo da mesma serie."
+    )
+
+
+def search_vehicles(term, data_version):
+    try:
+        return search_models(cached_engine(), term, trigram=cached_trigram_support())
+    except SQLAlchemyError:
+        return cached_search_index(data_version).search(term)
+
+
+def render_search(data_version):
+    st.markdown('<div class="section-title">Buscar modelo</div>', unsafe_allow_html=True)
+    term = st.text_input(
+        "Modelo ou codigo FIPE",
+        placeholder="Ex.: Onix 1.0, Legend, 038003",
+    )
+    if not term.strip():
+        st.caption("Digite parte do nome do modelo ou o inicio do codigo FIPE.")
+        return
+
+    started = time.perf_counter()
+    results = search_vehicles(term, data_version)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if results.empty:
+        st.info("Nenhum modelo encontrado.")
+        return
+
+    st.caption(f"{len(results)} modelos encontrados em {elapsed_ms:.0f} ms")
+    st.dataframe(results, use_container_width=True, hide_index=True)
+
+
 def render_empty_state():
     st.info(
         "A tabela fipe_carros ainda nao existe ou nao possui dados. "
@@ -271,7 +466,8 @@ def main():
     render_pipeline_action()
 
     try:
-        df = cached_data()
+        data_version = cached_data_version()
+        df = cached_data(data_version)
     except Exception as exc:
         st.error(f"Nao foi possivel carregar os dados: {exc}")
         return
@@ -280,49 +476,62 @@ def main():
         render_empty_state()
         return
 
-    df = df.dropna(subset=["valor", "ano_modelo"]).copy()
-    df["ano_modelo"] = df["ano_modelo"].astype(int)
+    filtered, max_rows, selection = apply_filters(df)
+    signature = filter_signature(data_version, *selection)
+    figure_cache = shared_figure_cache()
 
-    filtered, max_rows = apply_filters(df)
+    def cached_figure(name, build):
+        return figure_cache.get_or_build((name, signature), lambda: build(filtered))
 
-    total_records = len(filtered)
-    avg_price = filtered["valor"].mean()
-    max_price = filtered["valor"].max()
-    brands_count = filtered["marca"].nunique()
+    if approximate_kpis_enabled(df):
+        sketch = cached_kpi_sketch(data_version)
+        kpis = figure_cache.get_or_build(("kpis_approx", signature), lambda: sketch.kpis(*selection))
+    else:
+        kpis = cached_figure("kpis", compute_kpis)
 
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        render_kpi("Registros", f"{total_records:,}".replace(",", "."))
+        render_kpi("Registros", format_count(kpis["total_records"]))
     with col2:
-        render_kpi("Marcas", f"{brands_count:,}".replace(",", "."))
+        render_kpi(
+            "Marcas",
+            format_count(kpis["brands_count"]),
+            format_count(kpis["models_count"], kpis["models_error"]) + " modelos",
+        )
     with col3:
-        render_kpi("Preco medio", format_currency(avg_price))
+        render_kpi("Preco medio", format_currency(kpis["avg_price"]))
     with col4:
-        render_kpi("Maior preco", format_currency(max_price))
+        render_kpi("Maior preco", format_currency(kpis["max_price"]))
 
     if filtered.empty:
         st.warning("Nenhum registro encontrado para os filtros selecionados.")
         return
 
-    tab_overview, tab_distribution, tab_table = st.tabs(["Visao geral", "Distribuicao", "Dados"])
+    tab_overview, tab_distribution, tab_depreciation, tab_table, tab_search = st.tabs(
+        ["Visao geral", "Distribuicao", "Depreciacao", "Dados", "Busca"]
+    )
 
     with tab_overview:
         st.write("")
         left, right = st.columns([1.25, 1])
         with left:
             st.markdown('<div class="section-title">Preco medio por marca</div>', unsafe_allow_html=True)
-            st.plotly_chart(price_by_brand(filtered), use_container_width=True)
+            st.plotly_chart(cached_figure("price_by_brand", price_by_brand), use_container_width=True)
         with right:
             st.markdown('<div class="section-title">Preco medio por combustivel</div>', unsafe_allow_html=True)
-            st.plotly_chart(price_by_fuel(filtered), use_container_width=True)
+            st.plotly_chart(cached_figure("price_by_fuel", price_by_fuel), use_container_width=True)
 
         st.markdown('<div class="section-title">Evolucao do preco medio por ano</div>', unsafe_allow_html=True)
-        st.plotly_chart(price_by_year(filtered), use_container_width=True)
+        st.plotly_chart(cached_figure("price_by_year", price_by_year), use_container_width=True)
 
     with tab_distribution:
         st.write("")
         st.markdown('<div class="section-title">Distribuicao de precos</div>', unsafe_allow_html=True)
-        st.plotly_chart(price_distribution(filtered), use_container_width=True)
+        st.plotly_chart(cached_figure("price_distribution", price_distribution), use_container_width=True)
+
+    with tab_depreciation:
+        st.write("")
+        render_depreciation(filtered)
 
     with tab_table:
         st.write("")
@@ -342,6 +551,12 @@ def main():
             hide_index=True,
         )
 
+    with tab_search:
+        st.write("")
+        render_search(data_version)
+
+    render_figure_cache_stats(figure_cache)
+
 
 if __name__ == "__main__":
     main()
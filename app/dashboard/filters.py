@@ -0,0 +1,19 @@
+def prepare_data(df):
+    df = df.dropna(subset=["valor", "ano_modelo"]).copy()
+    df["ano_modelo"] = df["ano_modelo"].astype(int)
+    return df
+
+
+def filter_by_brands(df, brands):
+    return df[df["marca"].isin(brands)] if brands else df
+
+
+def filter_by_fuels_and_years(df, fuels, years):
+    return df[
+        df["combustivel"].isin(fuels)
+        & df["ano_modelo"].between(years[0], years[1])
+    ]
+
+
+def filter_data(df, brands, fuels, years):
+    return filter_by_fuels_and_years(filter_by_brands(df, brands), fuels, years)
@@ -1,49 +1,175 @@
-import os
-
 import pandas as pd
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
-
+from sqlalchemy import text
 
-def get_database_url():
-    load_dotenv(dotenv_path=".env")
-    database_url = os.getenv("DATABASE_URL")
-    if not database_url:
-        raise RuntimeError("DATABASE_URL nao definida no arquivo .env")
-    return database_url
+from app.dashboard.search import SEARCH_COLUMNS
+from app.db.engine import get_engine, stream_dataframes
 
 
-def get_engine():
-    return create_engine(get_database_url(), pool_pre_ping=True)
+FIPE_COLUMNS = [
+    "id",
+    "marca",
+    "modelo",
+    "ano_modelo",
+    "combustivel",
+    "valor_str",
+    "valor",
+    "codigo_fipe",
+    "sigla_combustivel",
+    "data_consulta",
+]
 
 
-def load_fipe_data(engine):
-    query = text("""
-        SELECT
-            id,
-            marca,
-            modelo,
-            ano_modelo,
-            combustivel,
-            valor_str,
-            valor,
-            codigo_fipe,
-            sigla_combustivel,
-            data_consulta
+def iter_fipe_data(engine=None, chunksize=None):
+    query = text(f"""
+        SELECT {", ".join(FIPE_COLUMNS)}
         FROM fipe_carros
         ORDER BY marca, modelo, ano_modelo DESC
     """)
-    return pd.read_sql_query(query, engine)
+    return stream_dataframes(query, chunksize=chunksize, engine=engine or get_engine())
+
 
+def load_fipe_data(engine, chunksize=None):
+    chunks = list(iter_fipe_data(engine, chunksize))
+    if not chunks:
+        return pd.DataFrame(columns=FIPE_COLUMNS)
+    return pd.concat(chunks, ignore_index=True)
 
-def table_exists(engine):
+
+def table_exists(engine, table_name="fipe_carros"):
     query = text("""
         SELECT EXISTS (
             SELECT 1
             FROM information_schema.tables
             WHERE table_schema = 'public'
-              AND table_name = 'fipe_carros'
+              AND table_name = :table_name
         )
     """)
+    with engine.connect() as conn:
+        return bool(conn.execute(query, {"table_name": table_name}).scalar())
+
+
+def load_depreciation_curves(engine, marca):
+    if not table_exists(engine, "fipe_depreciacao"):
+        return pd.DataFrame()
+    query = text("""
+        SELECT
+            nivel,
+            marca,
+            modelo,
+            ano_modelo,
+            anos_de_uso,
+            valor_medio,
+            retencao_anual,
+            retencao_acumulada,
+            modelos
+        FROM fipe_depreciacao
+        WHERE marca = :marca
+        ORDER BY nivel, modelo, anos_de_uso
+    """)
+    return pd.read_sql_query(query, engine, params={"marca": marca})
+
+
+def get_depreciation_version(engine):
+    """Token que muda a cada gravacao de ``fipe_depreciacao``.
+
+    A tabela e regravada depois da carga de ``fipe_carros``, entao as curvas
+    tem versao propria; retorna ``None`` se a tabela nao existe.
+    """
+    if not table_exists(engine, "fipe_depreciacao"):
+        return None
+    query = text("SELECT COUNT(*), MAX(atualizado_em) FROM fipe_depreciacao")
+    with engine.connect() as conn:
+        total, updated_at = conn.execute(query).one()
+    return f"{total}-{updated_at}"
+
+
+def get_data_version(engine):
+    """Token barato que muda quando ``fipe_carros`` e alterada ou recriada.
+
+    Combina o oid da tabela, que muda quando ela e recriada, com o contador de
+    linhas inseridas, atualizadas e removidas de ``pg_stat_user_tables``, que
+    tambem pega remocoes no meio da faixa de ids. As estatisticas sao
+    publicadas com atraso de alguns instantes e um reset delas so causa uma
+    recarga a mais. Os limites de ``id`` vem do indice da chave primaria.
+    Retorna ``None`` se a tabela nao existe.
+    """
+    if not table_exists(engine):
+        return None
+    query = text("""
+        SELECT
+            s.relid,
+            s.n_tup_ins + s.n_tup_upd + s.n_tup_del,
+            (SELECT COALESCE(MIN(id), 0) FROM fipe_carros),
+            (SELECT COALESCE(MAX(id), 0) FROM fipe_carros)
+        FROM pg_stat_user_tables s
+        WHERE s.schemaname = 'public'
+          AND s.relname = 'fipe_carros'
+    """)
+    with engine.connect() as conn:
+        relid, changes, min_id, max_id = conn.execute(query).one()
+    return f"{relid}-{changes}-{min_id}-{max_id}"
+
+
+def has_trigram_support(engine):
+    query = text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
     with engine.connect() as conn:
         return bool(conn.execute(query).scalar())
+
+
+def _escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_models(engine, term, limit=20, trigram=True):
+    """Busca modelos por trecho do nome ou prefixo do codigo FIPE.
+
+    Com ``pg_trgm`` o filtro ``ILIKE '%termo%'`` usa o indice GIN de trigramas
+    e o resultado e ordenado por similaridade; sem a extensao, a busca se
+    limita ao prefixo do modelo, atendida pelo indice ``text_pattern_ops``.
+    """
+    term = term.strip()
+    if not term:
+        return pd.DataFrame(columns=SEARCH_COLUMNS)
+
+    escaped = _escape_like(term)
+    if trigram:
+        where = "modelo ILIKE :contains OR codigo_fipe LIKE :codigo"
+        order = "similarity(modelo, :term) DESC,"
+    else:
+        where = "lower(modelo) LIKE :prefix OR codigo_fipe LIKE :codigo"
+        order = ""
+
+    query = text(f"""
+        SELECT
+            marca,
+            modelo,
+            codigo_fipe,
+            MIN(ano_modelo) AS ano_min,
+            MAX(ano_modelo) AS ano_max,
+            COUNT(*) AS registros,
+            MIN(valor) AS valor_min,
+            MAX(valor) AS valor_max
+        FROM fipe_carros
+        WHERE {where}
+        GROUP BY marca, modelo, codigo_fipe
+        ORDER BY
+            MAX(CASE
+                WHEN codigo_fipe LIKE :codigo THEN 3
+                WHEN lower(modelo) LIKE :prefix THEN 2
+                ELSE 1
+            END) DESC,
+            {order}
+            length(modelo),
+            modelo
+        LIMIT :limit
+    """)
+    params = {
+        "term": term,
+        "contains": f"%{escaped}%",
+        "prefix": f"{escaped.lower()}%",
+        "codigo": f"{escaped}%",
+        "limit": int(limit),
+    }
+    with engine.connect() as conn:
+        rows = conn.execute(query, params).all()
+    return pd.DataFrame.from_records(rows, columns=SEARCH_COLUMNS)
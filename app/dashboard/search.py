@@ -0,0 +1,99 @@
+import re
+import unicodedata
+from bisect import bisect_left
+
+import pandas as pd
+
+
+SEARCH_COLUMNS = [
+    "marca",
+    "modelo",
+    "codigo_fipe",
+    "ano_min",
+    "ano_max",
+    "registros",
+    "valor_min",
+    "valor_max",
+]
+
+
+def tokenize(value):
+    if not isinstance(value, str):
+        return []
+    normalized = unicodedata.normalize("NFKD", value.lower())
+    normalized = "".join(char for char in normalized if not unicodedata.combining(char))
+    return re.findall(r"[0-9a-z]+", normalized)
+
+
+class ModelSearchIndex:
+    """Indice de prefixos em memoria sobre ``modelo`` e ``codigo_fipe``.
+
+    Cada palavra do modelo e cada parte do codigo FIPE vira uma chave em uma
+    lista ordenada; a busca localiza a faixa de cada prefixo com ``bisect`` e
+    intersecta os resultados, sem percorrer o DataFrame a cada consulta.
+    """
+
+    def __init__(self, df):
+        if df.empty:
+            self.entries = pd.DataFrame(columns=SEARCH_COLUMNS)
+        else:
+            self.entries = (
+                df.groupby(["marca", "modelo", "codigo_fipe"], as_index=False, dropna=False)
+                .agg(
+                    ano_min=("ano_modelo", "min"),
+                    ano_max=("ano_modelo", "max"),
+                    registros=("ano_modelo", "size"),
+                    valor_min=("valor", "min"),
+                    valor_max=("valor", "max"),
+                )
+            )
+
+        postings = []
+        for entry_id, (modelo, codigo_fipe) in enumerate(
+            zip(self.entries["modelo"], self.entries["codigo_fipe"])
+        ):
+            for token in set(tokenize(modelo) + tokenize(codigo_fipe)):
+                postings.append((token, entry_id))
+        postings.sort()
+        self._keys = [token for token, _ in postings]
+        self._ids = [entry_id for _, entry_id in postings]
+        self._modelos = [" ".join(tokenize(modelo)) for modelo in self.entries["modelo"]]
+        self._codigos = [" ".join(tokenize(codigo)) for codigo in self.entries["codigo_fipe"]]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _prefix_ids(self, prefix):
+        start = bisect_left(self._keys, prefix)
+        end = bisect_left(self._keys, prefix + "\uffff", lo=start)
+        return set(self._ids[start:end])
+
+    def _rank(self, entry_id, query):
+        if self._codigos[entry_id].startswith(query):
+            return 3
+        if self._modelos[entry_id].startswith(query):
+            return 2
+        return 1
+
+    def search(self, term, limit=20):
+        words = tokenize(term)
+        if not words:
+            return self.entries.iloc[0:0]
+
+        ids = None
+        for word in words:
+            matches = self._prefix_ids(word)
+            ids = matches if ids is None else ids & matches
+            if not ids:
+                return self.entries.iloc[0:0]
+
+        query = " ".join(words)
+        ranked = sorted(
+            ids,
+            key=lambda entry_id: (
+                -self._rank(entry_id, query),
+                len(self._modelos[entry_id]),
+                self._modelos[entry_id],
+            ),
+        )
+        return self.entries.iloc[ranked[:limit]].reset_index(drop=True)
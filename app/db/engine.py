@@ -1,13 +1,88 @@
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
 import os
+import threading
 
-load_dotenv(dotenv_path=".env")
+_engine = None
+_engine_lock = threading.Lock()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+_STREAM_CHUNK_SIZE = int(os.getenv("DB_STREAM_CHUNK_SIZE", "20000"))
 
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL nao definida")
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+def get_database_url():
+    from dotenv import load_dotenv
 
+    load_dotenv(dotenv_path=".env")
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise RuntimeError("DATABASE_URL nao definida no arquivo .env")
+    return database_url
+
+
+def _engine_options(database_url):
+    from sqlalchemy.engine import make_url
+
+    options = {
+        "pool_pre_ping": True,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "2")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+
+    if make_url(database_url).get_backend_name() == "postgresql":
+        connect_args = {
+            "application_name": os.getenv("DB_APPLICATION_NAME", "fipe_pipeline"),
+        }
+        statement_timeout = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+        if statement_timeout > 0:
+            connect_args["options"] = f"-c statement_timeout={statement_timeout}"
+        options["connect_args"] = connect_args
+    return options
+
+
+def get_engine():
+    """Engine compartilhado do processo, criado no primeiro uso.
+
+    Pipeline e dashboard usam o mesmo pool, configurado por ``DB_POOL_SIZE``,
+    ``DB_MAX_OVERFLOW``, ``DB_POOL_TIMEOUT``, ``DB_POOL_RECYCLE``,
+    ``DB_STATEMENT_TIMEOUT_MS`` e ``DB_APPLICATION_NAME``.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                from sqlalchemy import create_engine
+
+                database_url = get_database_url()
+                _engine = create_engine(database_url, **_engine_options(database_url))
+    return _engine
+
+
+def dispose_engine():
+    """Fecha as conexoes do pool; o proximo ``get_engine`` cria outro engine."""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+
+
+def stream_dataframes(query, params=None, chunksize=None, engine=None):
+    """Executa ``query`` com cursor no servidor e devolve DataFrames em blocos.
+
+    Apenas um bloco de ``chunksize`` linhas fica em memoria por vez, o que
+    mantem exportacoes e analises sobre tabelas grandes com uso de memoria
+    constante.
+    """
+    import pandas as pd
+    from sqlalchemy import text
+
+    if isinstance(query, str):
+        query = text(query)
+    chunksize = chunksize or _STREAM_CHUNK_SIZE
+    engine = engine or get_engine()
+
+    with engine.connect() as conn:
+        result = conn.execution_options(yield_per=chunksize).execute(query, params or {})
+        columns = list(result.keys())
+        for partition in result.partitions():
+            yield pd.DataFrame.from_records(partition, columns=columns)
@@ -0,0 +1,442 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime
+
+from app.db.engine import get_engine
+from app.pipeline.fipe_import import (
+    _CACHE_PATH,
+    _TIMEOUT,
+    _emit,
+    _get_session,
+    _limpar_valor,
+)
+from app.utils.funcoes import configurar_logging, contexto_execucao
+
+logger = logging.getLogger("fipe.backfill")
+
+_API_V2_URL = os.getenv("FIPE_API_V2_URL", "https://fipe.parallelum.com.br/api/v2").rstrip("/")
+_MESES_PARALELOS = int(os.getenv("FIPE_BACKFILL_MONTHS_PARALLEL", "3"))
+_WORKERS_POR_MES = int(os.getenv("FIPE_BACKFILL_WORKERS_PER_MONTH", "4"))
+_CACHE_DIR = os.getenv("FIPE_BACKFILL_CACHE_DIR", os.path.join(os.path.dirname(_CACHE_PATH), "backfill"))
+_BATCH_SIZE = 500
+
+_INSERT_HISTORICO_SQL = """
+INSERT INTO fipe_carros_historico (
+    codigo_referencia, mes_referencia,
+    marca, modelo, ano_modelo, combustivel,
+    valor_str, valor, codigo_fipe, sigla_combustivel,
+    codigo_marca, codigo_modelo, codigo_ano
+) VALUES (
+    :codigo_referencia, :mes_referencia,
+    :marca, :modelo, :ano_modelo, :combustivel,
+    :valor_str, :valor, :codigo_fipe, :sigla_combustivel,
+    :codigo_marca, :codigo_modelo, :codigo_ano
+)
+ON CONFLICT (codigo_referencia, codigo_fipe, ano_modelo, combustivel)
+DO NOTHING
+"""
+
+
+class _RequisicaoUnica:
+    """Compartilha entre threads a mesma requisicao estrutural em andamento.
+
+    Quando duas threads pedem a mesma lista de marcas, modelos ou anos do
+    mesmo mes ao mesmo tempo, apenas a primeira vai a API; as demais esperam o
+    resultado, que tambem fica no cache do mes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._em_andamento = {}
+
+    def obter(self, cache_mes, chave, carregar):
+        cached = cache_mes.get(chave)
+        if cached is not None:
+            return cached
+
+        em_andamento = (cache_mes.path, chave)
+        with self._lock:
+            # outra thread pode ter terminado e gravado no cache depois da leitura acima
+            cached = cache_mes.get(chave)
+            if cached is not None:
+                return cached
+            future = self._em_andamento.get(em_andamento)
+            dono = future is None
+            if dono:
+                future = Future()
+                self._em_andamento[em_andamento] = future
+        if not dono:
+            return future.result()
+
+        try:
+            valor = carregar()
+            if valor is not None:
+                cache_mes.set(chave, valor)
+            future.set_result(valor)
+            return valor
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._em_andamento.pop(em_andamento, None)
+
+
+class _CacheMes:
+    """Catalogo e detalhes de um mes, em ``FIPE_BACKFILL_CACHE_DIR/<codigo>.json``.
+
+    Fica fora do ``fipe_cache.json``: cada mes e lido e regravado sozinho, e a
+    compactacao do cache da coleta nao toca nele. Um dict vazio registra que o
+    veiculo nao existe naquele mes e evita nova consulta.
+    """
+
+    def __init__(self, codigo_referencia):
+        self.path = os.path.join(_CACHE_DIR, f"{codigo_referencia}.json")
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(self.path, "r", encoding="utf-8") as cache_file:
+                self._dados = json.load(cache_file)
+        except (json.JSONDecodeError, OSError):
+            self._dados = {}
+
+    def get(self, chave):
+        with self._lock:
+            return self._dados.get(chave)
+
+    def set(self, chave, valor):
+        with self._lock:
+            self._dados[chave] = valor
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = dict(self._dados)
+            self._dirty = False
+        os.makedirs(_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as cache_file:
+            json.dump(data, cache_file, ensure_ascii=True)
+        os.replace(tmp_path, self.path)
+
+
+def _get_json(caminho, params=None):
+    resposta = _get_session().get(f"{_API_V2_URL}{caminho}", params=params, timeout=_TIMEOUT)
+    if resposta.status_code == 404:
+        return None
+    resposta.raise_for_status()
+    return resposta.json()
+
+
+def obter_referencias():
+    """Meses de referencia da tabela FIPE, do mais recente para o mais antigo."""
+    referencias = _get_json("/references") or []
+    return sorted(
+        ({"codigo": int(ref["code"]), "mes": ref["month"].strip()} for ref in referencias),
+        key=lambda ref: ref["codigo"],
+        reverse=True,
+    )
+
+
+def _listar(estrutura, cache_mes, referencia, chave, caminho, falhas):
+    import requests
+
+    params = {"reference": referencia["codigo"]}
+    try:
+        return estrutura.obter(cache_mes, chave, lambda: _get_json(caminho, params) or []) or []
+    except requests.RequestException as e:
+        logger.warning("Erro ao obter %s em %s: %s", caminho, referencia["mes"], e)
+        falhas["estrutura"] += 1
+        return []
+
+
+def _iterar_estrutura(estrutura, cache_mes, referencia, falhas):
+    """Percorre marcas, modelos e anos do catalogo do proprio mes de referencia."""
+    listar = functools.partial(_listar, estrutura, cache_mes, referencia, falhas=falhas)
+    for marca in listar("marcas", "/cars/brands"):
+        cod_marca = marca["code"]
+        modelos = listar(f"modelos:{cod_marca}", f"/cars/brands/{cod_marca}/models")
+        for modelo in modelos:
+            cod_modelo = modelo["code"]
+            anos = listar(
+                f"anos:{cod_marca}:{cod_modelo}",
+                f"/cars/brands/{cod_marca}/models/{cod_modelo}/years",
+            )
+            for ano in anos:
+                yield cod_marca, marca["name"], cod_modelo, modelo["name"], ano["code"]
+
+
+def _coletar_detalhe_mes(referencia, cache_mes, cod_marca, nome_marca, cod_modelo, nome_modelo, cod_ano):
+    import requests
+
+    chave = f"{cod_marca}:{cod_modelo}:{cod_ano}"
+    detalhe = cache_mes.get(chave)
+    if detalhe is None:
+        try:
+            detalhe = _get_json(
+                f"/cars/brands/{cod_marca}/models/{cod_modelo}/years/{cod_ano}",
+                params={"reference": referencia["codigo"]},
+            ) or {}
+        except requests.RequestException as e:
+            logger.warning("Erro no detalhe [%s %s %s] em %s: %s", nome_marca, nome_modelo, cod_ano, referencia["mes"], e)
+            raise
+        cache_mes.set(chave, detalhe)
+    if not detalhe:
+        return None
+
+    ano_modelo = detalhe.get("modelYear")
+    if not isinstance(ano_modelo, int) or not (1900 <= ano_modelo <= datetime.now().year):
+        ano_modelo = None
+
+    return {
+        "codigo_referencia": referencia["codigo"],
+        "mes_referencia": referencia["mes"],
+        "marca": nome_marca,
+        "modelo": nome_modelo,
+        "ano_modelo": ano_modelo,
+        "combustivel": detalhe.get("fuel"),
+        "valor_str": detalhe.get("price"),
+        "valor": _limpar_valor(detalhe.get("price")),
+        "codigo_fipe": detalhe.get("codeFipe"),
+        "sigla_combustivel": detalhe.get("fuelAcronym"),
+        "codigo_marca": str(cod_marca),
+        "codigo_modelo": str(cod_modelo),
+        "codigo_ano": str(cod_ano),
+    }
+
+
+def _garantir_tabelas(conn):
+    from sqlalchemy import text
+
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS fipe_carros_historico (
+        id SERIAL PRIMARY KEY,
+        codigo_referencia INTEGER NOT NULL,
+        mes_referencia VARCHAR(40),
+        marca VARCHAR(100),
+        modelo VARCHAR(150),
+        ano_modelo INTEGER,
+        combustivel VARCHAR(50),
+        valor_str VARCHAR(20),
+        valor FLOAT,
+        codigo_fipe VARCHAR(20),
+        sigla_combustivel VARCHAR(10),
+        codigo_marca VARCHAR(20),
+        codigo_modelo VARCHAR(20),
+        codigo_ano VARCHAR(20),
+        CONSTRAINT unique_fipe_historico UNIQUE (codigo_referencia, codigo_fipe, ano_modelo, combustivel)
+    );
+    """))
+
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS fipe_backfill_meses (
+        codigo_referencia INTEGER PRIMARY KEY,
+        mes_referencia VARCHAR(40),
+        status VARCHAR(20) NOT NULL,
+        registros INTEGER,
+        atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """))
+
+
+def _meses_concluidos(engine):
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        resultado = conn.execute(text(
+            "SELECT codigo_referencia FROM fipe_backfill_meses WHERE status = 'concluido'"
+        ))
+        return {codigo for codigo, in resultado}
+
+
+def _gravar_mes(engine, referencia, registros, status):
+    from sqlalchemy import text
+
+    validos = [
+        registro for registro in registros
+        if registro["codigo_fipe"] and registro["ano_modelo"] is not None and registro["valor"] is not None
+    ]
+    with engine.begin() as conn:
+        inseridos = 0
+        for i in range(0, len(validos), _BATCH_SIZE):
+            resultado = conn.execute(text(_INSERT_HISTORICO_SQL), validos[i:i + _BATCH_SIZE])
+            inseridos += resultado.rowcount or 0
+        conn.execute(text("""
+            INSERT INTO fipe_backfill_meses (codigo_referencia, mes_referencia, status, registros, atualizado_em)
+            VALUES (:codigo, :mes, :status, :registros, CURRENT_TIMESTAMP)
+            ON CONFLICT (codigo_referencia) DO UPDATE SET
+                status = EXCLUDED.status,
+                registros = EXCLUDED.registros,
+                atualizado_em = EXCLUDED.atualizado_em
+        """), {"codigo": referencia["codigo"], "mes": referencia["mes"], "status": status, "registros": len(validos)})
+    return len(validos), inseridos
+
+
+def _coletar_mes(referencia, estrutura, workers, limite, progress_callback=None):
+    """Coleta os detalhes de um mes e devolve ``(registros, falhas, completo)``.
+
+    ``falhas`` conta as requisicoes estruturais e de detalhe que terminaram em
+    erro; ``completo`` e falso quando ``limite`` interrompeu a coleta.
+    """
+    import requests
+
+    registros = []
+    falhas = Counter()
+    completo = True
+    cache_mes = _CacheMes(referencia["codigo"])
+
+    def absorver(done):
+        for future in done:
+            try:
+                resultado = future.result()
+            except requests.RequestException:
+                falhas["detalhes"] += 1
+                continue
+            if resultado:
+                registros.append(resultado)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"fipe-{referencia['codigo']}") as executor:
+            futures = set()
+            for tarefa in _iterar_estrutura(estrutura, cache_mes, referencia, falhas):
+                futures.add(
+                    executor.submit(contextvars.copy_context().run, _coletar_detalhe_mes, referencia, cache_mes, *tarefa)
+                )
+                if len(futures) < workers * 4:
+                    continue
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                absorver(done)
+                if limite and len(registros) >= limite:
+                    completo = False
+                    for future in futures:
+                        future.cancel()
+                    break
+
+            done, _ = wait(futures)
+            absorver(future for future in done if not future.cancelled())
+    finally:
+        cache_mes.save()
+
+    if limite and len(registros) > limite:
+        completo = False
+        registros = registros[:limite]
+    falhas = sum(falhas.values())
+    _emit(
+        progress_callback,
+        "backfill_month_collected",
+        f"{referencia['mes']}: {len(registros)} registros coletados ({falhas} falhas)",
+        reference=referencia["codigo"],
+        records=len(registros),
+        failed=falhas,
+    )
+    return registros, falhas, completo
+
+
+def executar_backfill(
+    meses=None,
+    referencias=None,
+    meses_paralelos=None,
+    workers_por_mes=None,
+    limite_por_mes=None,
+    progress_callback=None,
+):
+    """Carrega varios meses de referencia da FIPE em ``fipe_carros_historico``.
+
+    ``referencias`` escolhe codigos especificos; sem ele, usa os ``meses``
+    mais recentes. Ate ``meses_paralelos`` meses rodam ao mesmo tempo, cada um
+    com no maximo ``workers_por_mes`` requisicoes de detalhe simultaneas.
+    Cada mes percorre o catalogo de marcas, modelos e anos daquela referencia.
+    Meses ja marcados como concluidos em ``fipe_backfill_meses`` sao pulados,
+    entao uma execucao interrompida pode ser retomada. Um mes com requisicoes
+    que falharam, ou cortado por ``limite_por_mes``, fica como ``parcial`` e e
+    coletado de novo na proxima execucao.
+    """
+    configurar_logging()
+    meses_paralelos = meses_paralelos or _MESES_PARALELOS
+    workers_por_mes = workers_por_mes or _WORKERS_POR_MES
+
+    with contexto_execucao("backfill") as run_id:
+        engine = get_engine()
+        with engine.begin() as conn:
+            _garantir_tabelas(conn)
+
+        disponiveis = obter_referencias()
+        if referencias:
+            codigos = {int(codigo) for codigo in referencias}
+            selecionadas = [ref for ref in disponiveis if ref["codigo"] in codigos]
+        else:
+            selecionadas = disponiveis[:meses or 12]
+
+        concluidos = _meses_concluidos(engine)
+        pendentes = [ref for ref in selecionadas if ref["codigo"] not in concluidos]
+        _emit(
+            progress_callback,
+            "backfill_start",
+            (
+                f"Backfill de {len(selecionadas)} meses: {len(pendentes)} pendentes, "
+                f"{len(selecionadas) - len(pendentes)} ja concluidos"
+            ),
+            current=0,
+            total=len(pendentes),
+        )
+
+        estrutura = _RequisicaoUnica()
+        resumo_meses = []
+
+        def processar(referencia):
+            with contexto_execucao("backfill", run_id):
+                registros, falhas, completo = _coletar_mes(
+                    referencia, estrutura, workers_por_mes, limite_por_mes, progress_callback
+                )
+                status = "concluido" if completo and not falhas else "parcial"
+                validos, inseridos = _gravar_mes(engine, referencia, registros, status)
+                return {
+                    "reference": referencia["codigo"],
+                    "month": referencia["mes"],
+                    "status": status,
+                    "collected": len(registros),
+                    "failed": falhas,
+                    "valid": validos,
+                    "inserted": inseridos,
+                }
+
+        with ThreadPoolExecutor(max_workers=meses_paralelos, thread_name_prefix="fipe-backfill") as executor:
+            futures = {executor.submit(processar, referencia): referencia for referencia in pendentes}
+            for indice, future in enumerate(as_completed(futures), start=1):
+                referencia = futures[future]
+                try:
+                    resumo = future.result()
+                except Exception as e:
+                    logger.exception("Falha no backfill de %s", referencia["mes"])
+                    resumo = {"reference": referencia["codigo"], "month": referencia["mes"], "error": str(e)}
+                resumo_meses.append(resumo)
+                _emit(
+                    progress_callback,
+                    "backfill_month",
+                    f"Mes {indice}/{len(pendentes)} finalizado: {referencia['mes']}",
+                    current=indice,
+                    total=len(pendentes),
+                    month=resumo,
+                )
+
+        summary = {
+            "run_id": run_id,
+            "months_selected": len(selecionadas),
+            "months_skipped": len(selecionadas) - len(pendentes),
+            "months_done": sum(1 for resumo in resumo_meses if resumo.get("status") == "concluido"),
+            "months_partial": sum(1 for resumo in resumo_meses if resumo.get("status") == "parcial"),
+            "months_failed": sum(1 for resumo in resumo_meses if "error" in resumo),
+            "inserted": sum(resumo.get("inserted", 0) for resumo in resumo_meses),
+            "months": sorted(resumo_meses, key=lambda resumo: resumo["reference"], reverse=True),
+        }
+        _emit(progress_callback, "backfill_done", "Backfill concluido", summary=summary)
+        return summary
+
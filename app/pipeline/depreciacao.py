@@ -0,0 +1,176 @@
+from app.db.engine import get_engine, stream_dataframes
+
+COLUNAS_CURVA = [
+    "nivel",
+    "marca",
+    "modelo",
+    "ano_modelo",
+    "anos_de_uso",
+    "valor_medio",
+    "retencao_anual",
+    "retencao_acumulada",
+    "modelos",
+]
+
+_INSERT_CURVA_SQL = """
+INSERT INTO fipe_depreciacao (
+    nivel, marca, modelo, ano_modelo, anos_de_uso,
+    valor_medio, retencao_anual, retencao_acumulada, modelos
+) VALUES (
+    :nivel, :marca, :modelo, :ano_modelo, :anos_de_uso,
+    :valor_medio, :retencao_anual, :retencao_acumulada, :modelos
+)
+"""
+
+
+def _garantir_tabela(conn):
+    """Cria ``fipe_depreciacao``; retorna ``True`` se a tabela comecou vazia."""
+    from sqlalchemy import text
+
+    ano_modelo_nullable = conn.execute(text("""
+        SELECT is_nullable
+        FROM information_schema.columns
+        WHERE table_schema = 'public'
+          AND table_name = 'fipe_depreciacao'
+          AND column_name = 'ano_modelo'
+    """)).scalar()
+    if ano_modelo_nullable == "NO":
+        # a chave antiga usava ano_modelo tambem na curva da marca; a tabela e derivada, entao e refeita
+        conn.execute(text("DROP TABLE fipe_depreciacao"))
+
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS fipe_depreciacao (
+        nivel VARCHAR(10) NOT NULL,
+        marca VARCHAR(100) NOT NULL,
+        modelo VARCHAR(150) NOT NULL DEFAULT '',
+        ano_modelo INTEGER,
+        anos_de_uso INTEGER NOT NULL,
+        valor_medio FLOAT,
+        retencao_anual FLOAT,
+        retencao_acumulada FLOAT,
+        modelos INTEGER,
+        atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (nivel, marca, modelo, anos_de_uso)
+    );
+    """))
+    return ano_modelo_nullable != "YES"
+
+
+def _adicionar_retencao(curvas, chaves):
+    # ``curvas`` esta ordenada do ano-modelo mais novo para o mais antigo em cada grupo.
+    valores = curvas.groupby(chaves, sort=False)["valor_medio"]
+    anos = curvas.groupby(chaves, sort=False)["ano_modelo"]
+    curvas["anos_de_uso"] = anos.transform("first") - curvas["ano_modelo"]
+    curvas["retencao_anual"] = curvas["valor_medio"] / valores.shift(1)
+    curvas["retencao_acumulada"] = curvas["valor_medio"] / valores.transform("first")
+    return curvas
+
+
+def calcular_curvas_depreciacao(df):
+    """Calcula curvas de depreciacao por modelo e por marca.
+
+    ``retencao_anual`` e o preco medio de um ano-modelo dividido pelo do
+    ano-modelo imediatamente mais novo; ``retencao_acumulada`` divide pelo
+    ano-modelo mais novo do grupo. A curva da marca usa, para cada
+    ``anos_de_uso``, a mediana das retencoes dos seus modelos com essa idade,
+    para nao depender do mix de modelos de cada ano; como cada modelo tem o seu
+    ano-modelo mais novo, as linhas da marca ficam com ``ano_modelo`` nulo.
+    """
+    import pandas as pd
+
+    base = df.dropna(subset=["marca", "modelo", "ano_modelo", "valor"])
+    if base.empty:
+        return pd.DataFrame(columns=COLUNAS_CURVA)
+
+    modelos = (
+        base.groupby(["marca", "modelo", "ano_modelo"], as_index=False)["valor"]
+        .mean()
+        .rename(columns={"valor": "valor_medio"})
+        .sort_values(["marca", "modelo", "ano_modelo"], ascending=[True, True, False])
+    )
+    modelos = _adicionar_retencao(modelos, ["marca", "modelo"])
+    modelos["nivel"] = "modelo"
+    modelos["modelos"] = 1
+
+    marcas = (
+        modelos.groupby(["marca", "anos_de_uso"], as_index=False)
+        .agg(
+            valor_medio=("valor_medio", "mean"),
+            retencao_anual=("retencao_anual", "median"),
+            retencao_acumulada=("retencao_acumulada", "median"),
+            modelos=("modelo", "size"),
+        )
+        .sort_values(["marca", "anos_de_uso"])
+    )
+    marcas["ano_modelo"] = None
+    marcas["nivel"] = "marca"
+    marcas["modelo"] = ""
+
+    curvas = pd.concat([modelos[COLUNAS_CURVA], marcas[COLUNAS_CURVA]], ignore_index=True)
+    curvas["ano_modelo"] = curvas["ano_modelo"].astype("Int64")
+    return curvas
+
+
+def _registros(curvas):
+    import pandas as pd
+
+    curvas = curvas.astype(object).where(pd.notna(curvas), None)
+    return curvas.to_dict(orient="records")
+
+
+def atualizar_curvas_depreciacao(df_importado=None, engine=None):
+    """Recalcula e grava ``fipe_depreciacao``.
+
+    Com ``df_importado``, so os modelos presentes na ultima importacao e as
+    curvas das suas marcas sao recalculados; sem ele, ou quando a tabela
+    acabou de ser criada, a tabela inteira e refeita. Retorna a quantidade de
+    pontos de curva gravados.
+    """
+    import pandas as pd
+    from sqlalchemy import bindparam, text
+
+    engine = engine or get_engine()
+    with engine.begin() as conn:
+        tabela_vazia = _garantir_tabela(conn)
+
+    query = "SELECT marca, modelo, ano_modelo, valor FROM fipe_carros"
+    params = {}
+    modelos_afetados = None
+
+    if df_importado is not None and not tabela_vazia:
+        afetados = df_importado[["marca", "modelo"]].dropna().drop_duplicates()
+        if afetados.empty:
+            return 0
+        modelos_afetados = afetados
+        params["marcas"] = sorted(afetados["marca"].unique())
+        query = text(f"{query} WHERE marca IN :marcas").bindparams(bindparam("marcas", expanding=True))
+
+    chunks = list(stream_dataframes(query, params, engine=engine))
+    if chunks:
+        base = pd.concat(chunks, ignore_index=True)
+    else:
+        base = pd.DataFrame(columns=["marca", "modelo", "ano_modelo", "valor"])
+    curvas = calcular_curvas_depreciacao(base)
+
+    if modelos_afetados is not None:
+        chaves = pd.MultiIndex.from_frame(curvas[["marca", "modelo"]])
+        alvo = pd.MultiIndex.from_frame(modelos_afetados)
+        curvas = curvas[(curvas["nivel"] == "marca") | chaves.isin(alvo)]
+
+    with engine.begin() as conn:
+        if modelos_afetados is None:
+            conn.execute(text("DELETE FROM fipe_depreciacao"))
+        else:
+            conn.execute(
+                text("DELETE FROM fipe_depreciacao WHERE nivel = 'marca' AND marca IN :marcas")
+                .bindparams(bindparam("marcas", expanding=True)),
+                {"marcas": params["marcas"]},
+            )
+            conn.execute(
+                text("DELETE FROM fipe_depreciacao WHERE nivel = 'modelo' AND marca = :marca AND modelo = :modelo"),
+                modelos_afetados.to_dict(orient="records"),
+            )
+        if not curvas.empty:
+            conn.execute(text(_INSERT_CURVA_SQL), _registros(curvas))
+
+    return len(curvas)
@@ -1,43 +1,75 @@
+import contextvars
+import functools
+import io
 import json
+import logging
 import os
 import threading
+import time
+from collections import Counter, deque
 from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 
-import pandas as pd
-import requests
-from requests.adapters import HTTPAdapter, Retry
-from sqlalchemy import text
+from app.db.engine import get_engine
+from app.utils.funcoes import configurar_logging, contexto_execucao
 
-from app.db.engine import engine
+logger = logging.getLogger("fipe.pipeline")
 
 _CACHE_PATH = os.getenv("FIPE_CACHE_PATH", "logs/fipe_cache.json")
 _MAX_WORKERS = int(os.getenv("FIPE_MAX_WORKERS", "10"))
 _TIMEOUT = int(os.getenv("FIPE_TIMEOUT", "10"))
+_COLLECT_MODE = os.getenv("FIPE_COLLECT_MODE", "sequencial")
+_BRAND_QUOTA = os.getenv("FIPE_BRAND_QUOTA")
+_SKIP_KNOWN = os.getenv("FIPE_SKIP_KNOWN", "1") == "1"
+_SAVE_BATCH_SIZE = int(os.getenv("FIPE_SAVE_BATCH_SIZE", "100"))
+_SAVE_BATCH_MIN = 10
+_SAVE_BATCH_MAX = int(os.getenv("FIPE_SAVE_BATCH_MAX", "2000"))
+_SAVE_TARGET_SECONDS = float(os.getenv("FIPE_SAVE_TARGET_MS", "500")) / 1000
+_TIME_BUDGET = os.getenv("FIPE_TIME_BUDGET")
+_TIME_BUDGET_SAVE_FRACTION = float(os.getenv("FIPE_TIME_BUDGET_SAVE_FRACTION", "0.15"))
+_CACHE_SAVE_INTERVAL = float(os.getenv("FIPE_CACHE_SAVE_INTERVAL", "30"))
+_REPLAY_COPY_CHUNK = int(os.getenv("FIPE_REPLAY_COPY_CHUNK", "50000"))
+
+_MODOS_COLETA = ("sequencial", "estratificado")
 
 _cache = {}
+_cache_loaded = False
 _cache_dirty = False
 _cache_lock = threading.Lock()
+_cache_file_lock = threading.Lock()
 _thread_local = threading.local()
-
-retry_strategy = Retry(
-    total=3,
-    backoff_factor=0.3,
-    status_forcelist=[429, 500, 502, 503, 504]
-)
+_prazo_atual = contextvars.ContextVar("fipe_prazo", default=None)
 
 
 def _get_session():
-    session = getattr(_thread_local, "session", None)
+    # com prazo, sem retentativas: cada requisicao acaba dentro do tempo que restava ao ser enviada
+    com_prazo = _prazo_atual.get() is not None
+    atributo = "session_prazo" if com_prazo else "session"
+    session = getattr(_thread_local, atributo, None)
     if session is None:
+        import requests
+        from requests.adapters import HTTPAdapter, Retry
+
+        retry_strategy = Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504]
+        )
         session = requests.Session()
-        adapter = HTTPAdapter(max_retries=retry_strategy)
+        adapter = HTTPAdapter(max_retries=0 if com_prazo else retry_strategy)
         session.mount("https://", adapter)
         session.mount("http://", adapter)
-        _thread_local.session = session
+        setattr(_thread_local, atributo, session)
     return session
 
 
+def _timeout():
+    prazo = _prazo_atual.get()
+    if prazo is None:
+        return _TIMEOUT
+    return max(min(_TIMEOUT, prazo.restante()), 0.01)
+
+
 def _load_cache():
     global _cache
     if not os.path.exists(_CACHE_PATH):
@@ -50,37 +82,95 @@ def _load_cache():
         _cache = {}
 
 
+def _ensure_cache_loaded():
+    # o arquivo do cache so e lido no primeiro acesso, nao no import do modulo
+    global _cache_loaded
+    if _cache_loaded:
+        return
+    with _cache_file_lock:
+        if not _cache_loaded:
+            _load_cache()
+            _cache_loaded = True
+
+
 def _save_cache():
     global _cache_dirty
-    with _cache_lock:
-        if not _cache_dirty:
-            return
-        data = dict(_cache)
-        _cache_dirty = False
-    cache_dir = os.path.dirname(_CACHE_PATH)
-    if cache_dir:
-        os.makedirs(cache_dir, exist_ok=True)
-    with open(_CACHE_PATH, "w", encoding="utf-8") as cache_file:
-        json.dump(data, cache_file, ensure_ascii=True)
+    # a copia e tirada com o arquivo travado: um snapshot mais antigo nunca sobrescreve um mais novo
+    with _cache_file_lock:
+        with _cache_lock:
+            if not _cache_dirty:
+                return
+            data = dict(_cache)
+            _cache_dirty = False
+        cache_dir = os.path.dirname(_CACHE_PATH)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{_CACHE_PATH}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as cache_file:
+                json.dump(data, cache_file, ensure_ascii=True)
+            os.replace(tmp_path, _CACHE_PATH)
+        except OSError:
+            with _cache_lock:
+                _cache_dirty = True
+            raise
 
 
 def _cache_get(key):
+    _ensure_cache_loaded()
     with _cache_lock:
         return _cache.get(key)
 
 
 def _cache_set(key, value):
     global _cache_dirty
+    _ensure_cache_loaded()
     with _cache_lock:
         _cache[key] = value
         _cache_dirty = True
 
 
-_load_cache()
+def estatisticas_cache():
+    _ensure_cache_loaded()
+    with _cache_lock:
+        itens = list(_cache.items())
+    por_tipo = Counter(chave.split(":", 1)[0] for chave, _ in itens)
+    return {
+        "path": _CACHE_PATH,
+        "size_bytes": os.path.getsize(_CACHE_PATH) if os.path.exists(_CACHE_PATH) else 0,
+        "entries": len(itens),
+        "by_kind": dict(por_tipo),
+        "empty": sum(1 for _, valor in itens if not valor),
+    }
+
+
+def _entrada_inutil(chave, valor):
+    if not valor:
+        return True
+    return chave.startswith("detalhes:") and not (isinstance(valor, dict) and valor.get("Valor"))
+
+
+def compactar_cache():
+    """Remove entradas vazias ou detalhes sem preco e regrava o arquivo do cache.
+
+    Essas entradas vem de respostas incompletas da API; sem elas, a proxima
+    coleta volta a consultar esses itens.
+    """
+    global _cache_dirty
+    _ensure_cache_loaded()
+    with _cache_lock:
+        removidas = [chave for chave, valor in _cache.items() if _entrada_inutil(chave, valor)]
+        for chave in removidas:
+            del _cache[chave]
+        _cache_dirty = True
+    _save_cache()
+    return {"removed": len(removidas), **estatisticas_cache()}
+
 
 
 def _emit(progress_callback, event, message, **data):
-    print(message)
+    configurar_logging()
+    logger.info(message, extra={"event": event, "data": data})
     if callable(progress_callback):
         progress_callback({
             "event": event,
@@ -97,16 +187,16 @@ def obter_marcas():
     if cached is not None:
         return cached
     try:
-        resposta = _get_session().get(url, timeout=_TIMEOUT)
+        resposta = _get_session().get(url, timeout=_timeout())
         resposta.raise_for_status()
         dados = resposta.json()
         if isinstance(dados, list) and all(isinstance(m, dict) for m in dados):
             _cache_set(cache_key, dados)
             return dados
-        print(" Retorno inesperado da API de marcas.")
+        logger.warning("Retorno inesperado da API de marcas.")
         return []
     except Exception as e:
-        print(f" Erro ao obter marcas: {e}")
+        logger.warning("Erro ao obter marcas: %s", e)
         return []
 
 
@@ -118,13 +208,13 @@ def obter_modelos(codigo_marca):
     if cached is not None:
         return cached
     try:
-        resposta = _get_session().get(url, timeout=_TIMEOUT)
+        resposta = _get_session().get(url, timeout=_timeout())
         resposta.raise_for_status()
         dados = resposta.json().get("modelos", [])
         _cache_set(cache_key, dados)
         return dados
     except Exception as e:
-        print(f" Erro ao obter modelos da marca {codigo_marca}: {e}")
+        logger.warning("Erro ao obter modelos da marca %s: %s", codigo_marca, e)
         return []
 
 
@@ -136,13 +226,13 @@ def obter_anos(codigo_marca, codigo_modelo):
     if cached is not None:
         return cached
     try:
-        resposta = _get_session().get(url, timeout=_TIMEOUT)
+        resposta = _get_session().get(url, timeout=_timeout())
         resposta.raise_for_status()
         dados = resposta.json()
         _cache_set(cache_key, dados)
         return dados
     except Exception as e:
-        print(f" Erro ao obter anos [{codigo_marca}/{codigo_modelo}]: {e}")
+        logger.warning("Erro ao obter anos [%s/%s]: %s", codigo_marca, codigo_modelo, e)
         return []
 
 
@@ -154,18 +244,20 @@ def obter_detalhes(codigo_marca, codigo_modelo, codigo_ano):
     if cached is not None:
         return cached
     try:
-        resposta = _get_session().get(url, timeout=_TIMEOUT)
+        resposta = _get_session().get(url, timeout=_timeout())
         resposta.raise_for_status()
         dados = resposta.json()
         _cache_set(cache_key, dados)
         return dados
     except Exception as e:
-        print(f" Erro ao obter detalhes: {e}")
+        logger.warning("Erro ao obter detalhes [%s/%s/%s]: %s", codigo_marca, codigo_modelo, codigo_ano, e)
         return {}
 
 
 
 def _coletar_detalhe(cod_marca, nome_marca, cod_modelo, nome_modelo, cod_ano):
+    import requests
+
     try:
         detalhe = obter_detalhes(cod_marca, cod_modelo, cod_ano)
         if not detalhe:
@@ -181,6 +273,9 @@ def _coletar_detalhe(cod_marca, nome_marca, cod_modelo, nome_modelo, cod_ano):
         return {
             "marca": nome_marca,
             "modelo": nome_modelo,
+            "codigo_marca": str(cod_marca),
+            "codigo_modelo": str(cod_modelo),
+            "codigo_ano": str(cod_ano),
             "ano_modelo": ano_modelo,
             "combustivel": detalhe.get("Combustivel"),
             "valor_str": detalhe.get("Valor"),
@@ -190,126 +285,440 @@ def _coletar_detalhe(cod_marca, nome_marca, cod_modelo, nome_modelo, cod_ano):
             "data_consulta": detalhe.get("DataConsulta")
         }
     except requests.RequestException as e:
-        print(f"\n API Error [{nome_marca} {nome_modelo}]: {e}")
+        logger.warning("API Error [%s %s]: %s", nome_marca, nome_modelo, e)
         return None
     except Exception as e:
-        print(f"\n Unexpected error [{nome_marca} {nome_modelo}]: {e}")
+        logger.exception("Unexpected error [%s %s]: %s", nome_marca, nome_modelo, e)
         return None
 
 
-def _drain_futures(futures, registros, limite_registros, progress_callback=None):
-    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+def _registrar_resultado(resultado, registros, limite_registros, progress_callback=None):
+    if resultado:
+        registros.append(resultado)
+        if len(registros) % 10 == 0:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Registros coletados: %d", len(registros))
+            if callable(progress_callback):
+                progress_callback({
+                    "event": "records",
+                    "message": f"{len(registros)} registros coletados",
+                    "current": len(registros),
+                    "total": limite_registros,
+                })
+    return len(registros) >= limite_registros
+
+
+def _drain_futures(futures, registros, limite_registros, progress_callback=None, timeout=None):
+    done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
     for future in done:
         futures.remove(future)
-        resultado = future.result()
-        if resultado:
-            registros.append(resultado)
-            if len(registros) % 10 == 0:
-                print(f" Registros coletados: {len(registros)}", end="\r")
-                if callable(progress_callback):
-                    progress_callback({
-                        "event": "records",
-                        "message": f"{len(registros)} registros coletados",
-                        "current": len(registros),
-                        "total": limite_registros,
-                    })
-            if len(registros) >= limite_registros:
-                return True
+        if _registrar_resultado(future.result(), registros, limite_registros, progress_callback):
+            return True
     return False
 
 
-def coletar_dados_fipe(limite_registros=600, progress_callback=None):
+class _Prazo:
+    """Relogio de uma coleta com prazo.
+
+    Mantem uma media movel da duracao dos detalhes para so enviar uma
+    requisicao quando ela, somada a fila ja enviada, ainda termina a tempo.
+    """
+
+    def __init__(self, segundos):
+        self.segundos = segundos
+        self.fim = time.monotonic() + segundos
+        self.latencia = None
+        self._lock = threading.Lock()
+
+    def restante(self):
+        return max(0.0, self.fim - time.monotonic())
+
+    def esgotado(self):
+        return time.monotonic() >= self.fim
+
+    def cabe(self, pendentes, max_workers):
+        with self._lock:
+            latencia = self.latencia or 0.0
+        return self.restante() > latencia * (pendentes // max_workers + 1)
+
+    def medir(self, funcao, *args):
+        inicio = time.monotonic()
+        try:
+            return funcao(*args)
+        finally:
+            duracao = time.monotonic() - inicio
+            with self._lock:
+                self.latencia = duracao if self.latencia is None else 0.8 * self.latencia + 0.2 * duracao
+
+
+def _codigo_ano(ano):
+    return ano["codigo"] if isinstance(ano, dict) else ano
+
+
+def _detalhe_em_cache(cod_marca, cod_modelo, cod_ano):
+    return bool(_cache_get(f"detalhes:{cod_marca}:{cod_modelo}:{cod_ano}"))
+
+
+def _anos_por_custo(cod_marca, cod_modelo, priorizar_cache):
+    anos = [_codigo_ano(ano) for ano in obter_anos(cod_marca, cod_modelo) or []]
+    if priorizar_cache:
+        anos.sort(key=lambda cod_ano: not _detalhe_em_cache(cod_marca, cod_modelo, cod_ano))
+    return anos
+
+
+def _modelos_por_custo(cod_marca, priorizar_cache):
+    """Separa os modelos em (quentes, frios).
+
+    Quentes sao os modelos com a lista de anos em cache: cada registro custa no
+    maximo uma requisicao, e nenhuma se o detalhe tambem estiver em cache (esses
+    vem primeiro). Sem ``priorizar_cache`` todos os modelos sao frios.
+    """
+    modelos = obter_modelos(cod_marca)
+    if not priorizar_cache:
+        return [], list(modelos)
+
+    quentes, frios = [], []
+    for modelo in modelos:
+        anos = _cache_get(f"anos:{cod_marca}:{modelo['codigo']}")
+        if anos is None:
+            frios.append(modelo)
+        else:
+            detalhes = any(_detalhe_em_cache(cod_marca, modelo["codigo"], _codigo_ano(ano)) for ano in anos)
+            quentes.append((not detalhes, modelo))
+    return [modelo for _, modelo in sorted(quentes, key=lambda item: item[0])], frios
+
+
+def _marcas_por_custo(marcas, priorizar_cache):
+    if not priorizar_cache:
+        return list(marcas)
+    return sorted(marcas, key=lambda marca: _cache_get(f"modelos:{marca.get('codigo')}") is None)
+
+
+def _iterar_sequencial(marcas, ao_iniciar_marca, pular=None, priorizar_cache=False):
+    for marca_index, marca in enumerate(_marcas_por_custo(marcas, priorizar_cache), start=1):
+        cod_marca = marca.get("codigo")
+        nome_marca = marca.get("nome")
+        ao_iniciar_marca(marca_index, nome_marca)
+
+        quentes, frios = _modelos_por_custo(cod_marca, priorizar_cache)
+        for modelo in quentes + frios:
+            cod_modelo = modelo["codigo"]
+            nome_modelo = modelo["nome"]
+            for cod_ano in _anos_por_custo(cod_marca, cod_modelo, priorizar_cache):
+                tarefa = (cod_marca, nome_marca, cod_modelo, nome_modelo, cod_ano)
+                if pular is None or not pular(tarefa):
+                    yield tarefa
+
+
+def _cota_da_marca(cota_por_marca, marca):
+    if cota_por_marca is None:
+        return None
+    if isinstance(cota_por_marca, dict):
+        for chave in (marca.get("nome"), str(marca.get("codigo")), "*"):
+            if chave in cota_por_marca:
+                return int(cota_por_marca[chave])
+        return None
+    return int(cota_por_marca)
+
+
+def _iterar_estratificado(marcas, ao_iniciar_marca, cota_por_marca=None, pular=None, priorizar_cache=False):
+    """Intercala marcas e modelos em rodizio.
+
+    Cada volta da fila entrega uma tarefa por marca, alternando o modelo
+    dentro da marca. Modelos e anos so sao consultados quando a marca ou o
+    modelo e visitado pela primeira vez, entao um limite pequeno nao percorre
+    a arvore inteira da API. Tarefas descartadas por ``pular`` nao sao
+    entregues nem contam na cota da marca.
+
+    Com ``priorizar_cache`` o rodizio tem dois niveis: enquanto alguma marca
+    tiver modelos quentes (ver ``_modelos_por_custo``), so elas entram na
+    volta; as demais esperam na fila fria. A cota de cada marca vale para os
+    dois niveis somados.
+    """
+    def quente(estado):
+        if estado["quentes"] is None:
+            return priorizar_cache and _cache_get(f"modelos:{estado['marca'].get('codigo')}") is not None
+        return bool(estado["quentes"])
+
+    fila_quente, fila_fria = deque(), deque()
+    for marca_index, marca in enumerate(marcas, start=1):
+        estado = {
+            "indice": marca_index,
+            "marca": marca,
+            "cota": _cota_da_marca(cota_por_marca, marca),
+            "quentes": None,
+            "frios": None,
+            "enviados": 0,
+        }
+        (fila_quente if quente(estado) else fila_fria).append(estado)
+
+    while fila_quente or fila_fria:
+        estado = (fila_quente or fila_fria).popleft()
+        cota = estado["cota"]
+        if cota is not None and estado["enviados"] >= cota:
+            continue
+
+        cod_marca = estado["marca"].get("codigo")
+        nome_marca = estado["marca"].get("nome")
+        if estado["quentes"] is None:
+            ao_iniciar_marca(estado["indice"], nome_marca)
+            quentes, frios = _modelos_por_custo(cod_marca, priorizar_cache)
+            estado["quentes"] = deque([modelo, None] for modelo in quentes)
+            estado["frios"] = deque([modelo, None] for modelo in frios)
+        if not estado["quentes"] and fila_quente:
+            fila_fria.append(estado)
+            continue
+
+        tarefa = None
+        for fila_modelos in (estado["quentes"], estado["frios"]):
+            while fila_modelos and tarefa is None:
+                item = fila_modelos.popleft()
+                modelo, anos = item
+                if anos is None:
+                    anos = deque(_anos_por_custo(cod_marca, modelo["codigo"], priorizar_cache))
+                    item[1] = anos
+                while anos and tarefa is None:
+                    tarefa = (cod_marca, nome_marca, modelo["codigo"], modelo["nome"], anos.popleft())
+                    if pular is not None and pular(tarefa):
+                        tarefa = None
+                if anos:
+                    fila_modelos.append(item)
+            if tarefa is not None:
+                break
+
+        if tarefa is None:
+            continue
+
+        yield tarefa
+        estado["enviados"] += 1
+        if (estado["quentes"] or estado["frios"]) and (cota is None or estado["enviados"] < cota):
+            (fila_quente if quente(estado) else fila_fria).append(estado)
+
+
+def carregar_chaves_conhecidas(engine=None):
+    """Chaves ``marca:modelo:ano`` da API ja gravadas em ``fipe_carros``.
+
+    A gravacao usa ``ON CONFLICT DO NOTHING``, entao um veiculo ja gravado nunca
+    e atualizado e consultar o detalhe de novo so geraria um conflito. Se a
+    tabela ainda nao existe, retorna um conjunto vazio.
+    """
+    from sqlalchemy import text
+
+    query = text("""
+        SELECT codigo_marca, codigo_modelo, codigo_ano
+        FROM fipe_carros
+        WHERE codigo_marca IS NOT NULL
+    """)
+    engine = engine or get_engine()
+    with engine.connect() as conn:
+        if conn.execute(text("SELECT to_regclass('public.fipe_carros')")).scalar() is None:
+            return frozenset()
+        result = conn.execution_options(yield_per=50000).execute(query)
+        return frozenset(f"{marca}:{modelo}:{ano}" for marca, modelo, ano in result)
+
+
+def _resultado_coleta(registros, ignorados):
+    import pandas as pd
+
+    df = pd.DataFrame(registros)
+    df.attrs["skipped"] = ignorados
+    return df
+
+
+def _encerrar_no_limite(registros, limite_registros, ignorados, progress_callback=None):
+    _emit(
+        progress_callback,
+        "collect_limit",
+        f"Limite de {limite_registros} registros atingido ({ignorados} ja existentes pulados)",
+        current=len(registros),
+        total=limite_registros,
+        skipped=ignorados,
+    )
+    _save_cache()
+    return _resultado_coleta(registros, ignorados)
+
+
+def _encerrar_no_prazo(registros, limite_registros, ignorados, prazo, progress_callback=None):
+    _emit(
+        progress_callback,
+        "collect_deadline",
+        (
+            f"Prazo de {prazo.segundos:g}s esgotado com {len(registros)} registros "
+            f"({ignorados} ja existentes pulados)"
+        ),
+        current=len(registros),
+        total=limite_registros,
+        skipped=ignorados,
+    )
+    _save_cache()
+    df = _resultado_coleta(registros, ignorados)
+    df.attrs["deadline_reached"] = True
+    return df
+
+
+def coletar_dados_fipe(
+    limite_registros=600,
+    progress_callback=None,
+    modo=None,
+    cota_por_marca=None,
+    pular_conhecidos=None,
+    max_workers=None,
+    prazo_segundos=None,
+):
+    """Coleta detalhes da API FIPE ate atingir ``limite_registros``.
+
+    ``modo="sequencial"`` percorre as marcas em ordem alfabetica, como a API as
+    devolve. ``modo="estratificado"`` intercala marcas e modelos em rodizio,
+    para que qualquer limite cubra o maior numero possivel de marcas;
+    ``cota_por_marca`` (inteiro ou dict por nome/codigo da marca, com ``"*"``
+    como padrao) limita quantos detalhes sao pedidos de cada marca.
+
+    Com ``pular_conhecidos`` (padrao: ``FIPE_SKIP_KNOWN``), veiculos ja gravados
+    em ``fipe_carros`` nao geram requisicao de detalhe; o total pulado
+    fica em ``df.attrs["skipped"]``.
+
+    Com ``prazo_segundos`` (padrao: ``FIPE_TIME_BUDGET``), a coleta para no
+    prazo e devolve o que ja foi coletado. O modo e as cotas continuam valendo,
+    mas dentro deles os ramos mais baratos vem primeiro: detalhes ja em cache,
+    depois modelos com anos em cache e so entao o resto da arvore; requisicoes
+    que nao terminariam a tempo nao sao enviadas e as pendentes sao canceladas.
+    Cada requisicao da coleta usa no maximo o tempo que ainda resta, sem
+    retentativas, entao nenhuma segue rodando depois do prazo.
+    """
+    # o prazo fica em um contextvar copiado para as threads do pool; a copia aqui o descarta no fim
+    return contextvars.copy_context().run(
+        _coletar_dados_fipe,
+        limite_registros,
+        progress_callback,
+        modo,
+        cota_por_marca,
+        pular_conhecidos,
+        max_workers,
+        prazo_segundos,
+    )
+
+
+def _coletar_dados_fipe(
+    limite_registros, progress_callback, modo, cota_por_marca, pular_conhecidos, max_workers, prazo_segundos
+):
+    from sqlalchemy.exc import SQLAlchemyError
+
+    configurar_logging()
+    modo = modo or _COLLECT_MODE
+    max_workers = max_workers or _MAX_WORKERS
+    if modo not in _MODOS_COLETA:
+        raise ValueError(f"Modo de coleta invalido: {modo}. Use um de {', '.join(_MODOS_COLETA)}")
+    if cota_por_marca is None and _BRAND_QUOTA:
+        cota_por_marca = int(_BRAND_QUOTA)
+    if pular_conhecidos is None:
+        pular_conhecidos = _SKIP_KNOWN
+    if prazo_segundos is None and _TIME_BUDGET:
+        prazo_segundos = float(_TIME_BUDGET)
+    prazo = _Prazo(prazo_segundos) if prazo_segundos else None
+    _prazo_atual.set(prazo)
+
+    conhecidas = frozenset()
+    if pular_conhecidos:
+        try:
+            conhecidas = carregar_chaves_conhecidas()
+        except (SQLAlchemyError, RuntimeError) as e:
+            _emit(progress_callback, "known_keys_error", f"Indice de chaves conhecidas indisponivel: {e}")
+
     registros = []
+    ignorados = 0
     marcas = obter_marcas()
 
     _emit(
         progress_callback,
         "collect_start",
-        f"Coletando dados da API FIPE (limite: {limite_registros})",
+        (
+            f"Coletando dados da API FIPE (limite: {limite_registros}, modo: {modo}, "
+            f"{len(conhecidas)} veiculos ja gravados)"
+        ),
         current=0,
         total=limite_registros,
     )
 
-    with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as executor:
-        futures = []
-        for marca_index, marca in enumerate(marcas, start=1):
-            cod_marca = marca.get("codigo")
-            nome_marca = marca.get("nome")
-            _emit(
-                progress_callback,
-                "brand",
-                f"Processando marca {marca_index}/{len(marcas)}: {nome_marca}",
-                current=len(registros),
-                total=limite_registros,
-                brand=nome_marca,
-            )
+    def ao_iniciar_marca(marca_index, nome_marca):
+        _emit(
+            progress_callback,
+            "brand",
+            f"Processando marca {marca_index}/{len(marcas)}: {nome_marca}",
+            current=len(registros),
+            total=limite_registros,
+            brand=nome_marca,
+        )
+
+    def ja_gravada(tarefa):
+        nonlocal ignorados
+        cod_marca, _, cod_modelo, _, cod_ano = tarefa
+        if f"{cod_marca}:{cod_modelo}:{cod_ano}" in conhecidas:
+            ignorados += 1
+            return True
+        return False
+
+    coletar = functools.partial(prazo.medir, _coletar_detalhe) if prazo else _coletar_detalhe
+    if modo == "estratificado":
+        tarefas = _iterar_estratificado(
+            marcas, ao_iniciar_marca, cota_por_marca, pular=ja_gravada, priorizar_cache=prazo is not None
+        )
+    else:
+        tarefas = _iterar_sequencial(marcas, ao_iniciar_marca, pular=ja_gravada, priorizar_cache=prazo is not None)
 
-            modelos = obter_modelos(cod_marca)
-            for modelo in modelos:
-                cod_modelo = modelo["codigo"]
-                nome_modelo = modelo["nome"]
-
-                anos = obter_anos(cod_marca, cod_modelo)
-                if not anos:
-                    continue
-
-                for ano in anos:
-                    cod_ano = ano["codigo"] if isinstance(ano, dict) else ano
-                    futures.append(
-                        executor.submit(
-                            _coletar_detalhe,
-                            cod_marca,
-                            nome_marca,
-                            cod_modelo,
-                            nome_modelo,
-                            cod_ano
-                        )
-                    )
-
-                    if len(futures) >= _MAX_WORKERS * 4:
-                        limite_atingido = _drain_futures(
-                            futures,
-                            registros,
-                            limite_registros,
-                            progress_callback,
-                        )
-                        if limite_atingido:
-                            _emit(
-                                progress_callback,
-                                "collect_limit",
-                                f"Limite de {limite_registros} registros atingido",
-                                current=len(registros),
-                                total=limite_registros,
-                            )
-                            _save_cache()
-                            return pd.DataFrame(registros)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = []
+    sem_tempo = False
+    ultimo_save = time.monotonic()
+    try:
+        for tarefa in tarefas:
+            if prazo and _detalhe_em_cache(tarefa[0], tarefa[2], tarefa[4]):
+                # detalhe em cache nao custa requisicao: resolve aqui, sem ocupar o pool
+                if _registrar_resultado(_coletar_detalhe(*tarefa), registros, limite_registros, progress_callback):
+                    return _encerrar_no_limite(registros, limite_registros, ignorados, progress_callback)
+                if prazo.esgotado():
+                    return _encerrar_no_prazo(registros, limite_registros, ignorados, prazo, progress_callback)
+                continue
+            if prazo:
+                while futures and not prazo.cabe(len(futures), max_workers):
+                    if _drain_futures(futures, registros, limite_registros, progress_callback, prazo.restante()):
+                        return _encerrar_no_limite(registros, limite_registros, ignorados, progress_callback)
+                    if prazo.esgotado():
+                        return _encerrar_no_prazo(registros, limite_registros, ignorados, prazo, progress_callback)
+                if not prazo.cabe(0, max_workers):
+                    sem_tempo = True
+                    break
+            futures.append(executor.submit(contextvars.copy_context().run, coletar, *tarefa))
+            if len(futures) >= max_workers * 4:
+                timeout = prazo.restante() if prazo else None
+                if _drain_futures(futures, registros, limite_registros, progress_callback, timeout):
+                    return _encerrar_no_limite(registros, limite_registros, ignorados, progress_callback)
+                if prazo and prazo.esgotado():
+                    return _encerrar_no_prazo(registros, limite_registros, ignorados, prazo, progress_callback)
+            if time.monotonic() - ultimo_save >= _CACHE_SAVE_INTERVAL:
+                _save_cache()
+                ultimo_save = time.monotonic()
 
         while futures:
-            limite_atingido = _drain_futures(
-                futures,
-                registros,
-                limite_registros,
-                progress_callback,
-            )
-            if limite_atingido:
-                _emit(
-                    progress_callback,
-                    "collect_limit",
-                    f"Limite de {limite_registros} registros atingido",
-                    current=len(registros),
-                    total=limite_registros,
-                )
-                _save_cache()
-                return pd.DataFrame(registros)
+            timeout = prazo.restante() if prazo else None
+            if _drain_futures(futures, registros, limite_registros, progress_callback, timeout):
+                return _encerrar_no_limite(registros, limite_registros, ignorados, progress_callback)
+            if prazo and prazo.esgotado():
+                return _encerrar_no_prazo(registros, limite_registros, ignorados, prazo, progress_callback)
+        if sem_tempo:
+            return _encerrar_no_prazo(registros, limite_registros, ignorados, prazo, progress_callback)
+    finally:
+        # com prazo, nao espera requisicoes em andamento; o timeout delas acaba no prazo
+        executor.shutdown(wait=prazo is None, cancel_futures=True)
 
     _save_cache()
-    df = pd.DataFrame(registros)
+    df = _resultado_coleta(registros, ignorados)
     _emit(
         progress_callback,
         "collect_done",
-        f"Total de registros coletados: {len(df)}",
+        f"Total de registros coletados: {len(df)} ({ignorados} ja existentes pulados)",
         current=len(df),
         total=limite_registros,
+        skipped=ignorados,
     )
     return df
 
@@ -324,164 +733,604 @@ def _limpar_valor(valor):
     except (ValueError, AttributeError):
         return None
 
-def salvar_no_banco(df, progress_callback=None):
-    with engine.begin() as conn:
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS fipe_carros (
-            id SERIAL PRIMARY KEY,
-            marca VARCHAR(100),
-            modelo VARCHAR(150),
-            ano_modelo INTEGER,
-            combustivel VARCHAR(50),
-            valor_str VARCHAR(20),
-            valor FLOAT,
-            codigo_fipe VARCHAR(20),
-            sigla_combustivel VARCHAR(10),
-            data_consulta DATE DEFAULT CURRENT_DATE,
-            CONSTRAINT unique_fipe UNIQUE (codigo_fipe, ano_modelo, combustivel)
-        );
-        """))
-
-        conn.execute(text("""
-        ALTER TABLE fipe_carros
-        ALTER COLUMN data_consulta SET DEFAULT CURRENT_DATE
-        """))
-
-        if df.empty:
-            _emit(progress_callback, "save_empty", "Nenhum dado coletado. Tabela garantida.")
-            return {
-                "collected": 0,
-                "valid": 0,
-                "inserted": 0,
-                "existing": 0,
-            }
 
-        collected_count = len(df)
-        df = df.copy()
-        df["ano_modelo"] = df["ano_modelo"].apply(
-            lambda x: int(x) if pd.notna(x) else None
-        )
-        df["valor"] = df["valor"].where(pd.notna(df["valor"]), None)
-
-        df = df[
-            df["codigo_fipe"].notna() &
-            df["ano_modelo"].notna() &
-            df["valor"].notna()
-        ]
-
-        if df.empty:
-            _emit(progress_callback, "save_empty", "Nenhum dado valido apos filtros.")
-            return {
-                "collected": collected_count,
-                "valid": 0,
-                "inserted": 0,
-                "existing": 0,
-            }
+def _limpar_valores(valores):
+    import pandas as pd
 
-        batch_size = 100
-        total_inserido = 0
-        total_validos = len(df)
-        total_batches = (len(df) + batch_size - 1) // batch_size
-        batch_failures = []
-
-        insert_sql = text("""
-        INSERT INTO fipe_carros (
-            marca, modelo, ano_modelo, combustivel,
-            valor_str, valor, codigo_fipe,
-            sigla_combustivel
-        ) VALUES (
-            :marca, :modelo, :ano_modelo, :combustivel,
-            :valor_str, :valor, :codigo_fipe,
-            :sigla_combustivel
-        )
-        ON CONFLICT (codigo_fipe, ano_modelo, combustivel)
-        DO NOTHING
-        """)
+    limpos = (
+        valores.astype("string")
+        .str.replace("R$", "", regex=False)
+        .str.replace(".", "", regex=False)
+        .str.replace(",", ".", regex=False)
+        .str.strip()
+    )
+    return pd.to_numeric(limpos, errors="coerce")
+
+
+def _normalizar_detalhes(chaves, detalhes, nomes_marcas, nomes_modelos):
+    import pandas as pd
+
+    chaves = pd.DataFrame(chaves, columns=["codigo_marca", "codigo_modelo", "codigo_ano"])
+    detalhes = pd.DataFrame.from_records(detalhes)
+    for coluna in (
+        "Marca", "Modelo", "AnoModelo", "Combustivel", "Valor",
+        "CodigoFipe", "SiglaCombustivel", "DataConsulta",
+    ):
+        if coluna not in detalhes:
+            detalhes[coluna] = None
+
+    ano_modelo = pd.to_numeric(detalhes["AnoModelo"], errors="coerce")
+    ano_modelo = ano_modelo.where(ano_modelo.between(1900, datetime.now().year))
+    modelos = pd.Series(list(zip(chaves["codigo_marca"], chaves["codigo_modelo"])))
+
+    return pd.DataFrame({
+        "marca": chaves["codigo_marca"].map(nomes_marcas).fillna(detalhes["Marca"]),
+        "modelo": modelos.map(nomes_modelos).fillna(detalhes["Modelo"]),
+        "codigo_marca": chaves["codigo_marca"],
+        "codigo_modelo": chaves["codigo_modelo"],
+        "codigo_ano": chaves["codigo_ano"],
+        "ano_modelo": ano_modelo.astype("Int64"),
+        "combustivel": detalhes["Combustivel"],
+        "valor_str": detalhes["Valor"],
+        "valor": _limpar_valores(detalhes["Valor"]),
+        "codigo_fipe": detalhes["CodigoFipe"],
+        "sigla_combustivel": detalhes["SiglaCombustivel"],
+        "data_consulta": detalhes["DataConsulta"],
+    })
+
+
+def coletar_dados_do_cache(progress_callback=None):
+    """Reconstroi os registros a partir das entradas do cache, sem chamadas HTTP.
+
+    Le diretamente as chaves ``marcas``, ``modelos:*``, ``anos:*`` e
+    ``detalhes:*``. Retorna o DataFrame normalizado e um dict com as lacunas
+    de cobertura encontradas na arvore marca > modelo > ano > detalhe.
+    """
+    import pandas as pd
+
+    _ensure_cache_loaded()
+    with _cache_lock:
+        cache = dict(_cache)
 
-        _emit(
-            progress_callback,
-            "save_start",
-            f"Salvando {len(df)} registros em {total_batches} batches",
-            current=0,
-            total=total_batches,
-        )
+    _emit(
+        progress_callback,
+        "collect_start",
+        f"Reconstruindo registros a partir do cache ({len(cache)} entradas)",
+        current=0,
+        total=len(cache),
+    )
 
-        for i in range(0, len(df), batch_size):
-            batch = df.iloc[i:i + batch_size]
-            batch_number = i // batch_size + 1
-            try:
-                result = conn.execute(insert_sql, batch.to_dict(orient="records"))
-                inserted_batch = result.rowcount or 0
-                total_inserido += inserted_batch
-                print(f" Batch {batch_number}: {len(batch)} registros processados", end="\r")
-                if callable(progress_callback):
-                    progress_callback({
-                        "event": "save_batch",
-                        "message": (
-                            f"Batch {batch_number}/{total_batches}: "
-                            f"{inserted_batch} novos, {len(batch) - inserted_batch} ja existentes"
-                        ),
-                        "current": batch_number,
-                        "total": total_batches,
-                        "inserted": total_inserido,
-                        "existing": (i + len(batch)) - total_inserido,
-                    })
-            except Exception as e:
-                batch_failures.append((batch_number, e))
-                _emit(
-                    progress_callback,
-                    "save_error",
-                    f"Erro no batch {batch_number}: {e}",
-                    current=batch_number,
-                    total=total_batches,
-                )
+    nomes_marcas = {str(marca.get("codigo")): marca.get("nome") for marca in cache.get("marcas") or []}
+    nomes_modelos = {}
+    lacunas = {
+        "sem_marcas": "marcas" not in cache,
+        "marcas_sem_modelos": [],
+        "modelos_sem_anos": [],
+        "anos_sem_detalhes": [],
+        "detalhes_vazios": 0,
+    }
+
+    for cod_marca in nomes_marcas:
+        modelos = cache.get(f"modelos:{cod_marca}")
+        if modelos is None:
+            lacunas["marcas_sem_modelos"].append(cod_marca)
+            continue
+        for modelo in modelos:
+            cod_modelo = str(modelo["codigo"])
+            nomes_modelos[(cod_marca, cod_modelo)] = modelo["nome"]
+            anos = cache.get(f"anos:{cod_marca}:{cod_modelo}")
+            if anos is None:
+                lacunas["modelos_sem_anos"].append(f"{cod_marca}:{cod_modelo}")
                 continue
+            for ano in anos:
+                chave = f"{cod_marca}:{cod_modelo}:{_codigo_ano(ano)}"
+                if f"detalhes:{chave}" not in cache:
+                    lacunas["anos_sem_detalhes"].append(chave)
+
+    chaves = []
+    detalhes = []
+    for chave, detalhe in cache.items():
+        if not chave.startswith("detalhes:"):
+            continue
+        if not detalhe:
+            lacunas["detalhes_vazios"] += 1
+            continue
+        chaves.append(chave.split(":", 3)[1:])
+        detalhes.append(detalhe)
 
-        if batch_failures:
-            primeiro_batch, primeiro_erro = batch_failures[0]
-            raise RuntimeError(
-                f"Falha ao salvar {len(batch_failures)} batch(s) na tabela fipe_carros; "
-                f"primeiro erro no batch {primeiro_batch}: {primeiro_erro}"
-            )
+    if detalhes:
+        df = _normalizar_detalhes(chaves, detalhes, nomes_marcas, nomes_modelos)
+    else:
+        df = pd.DataFrame()
 
-        _emit(
-            progress_callback,
-            "save_done",
-            (
-                f"Insercao finalizada: {total_inserido} novos, "
-                f"{total_validos - total_inserido} ja existentes"
-            ),
-            current=total_batches,
-            total=total_batches,
-            collected=collected_count,
-            valid=total_validos,
-            inserted=total_inserido,
-            existing=total_validos - total_inserido,
+    _emit(
+        progress_callback,
+        "collect_done",
+        (
+            f"Registros reconstruidos do cache: {len(df)}. Lacunas: "
+            f"{len(lacunas['marcas_sem_modelos'])} marcas sem modelos, "
+            f"{len(lacunas['modelos_sem_anos'])} modelos sem anos, "
+            f"{len(lacunas['anos_sem_detalhes'])} anos sem detalhes, "
+            f"{lacunas['detalhes_vazios']} detalhes vazios"
+        ),
+        current=len(cache),
+        total=len(cache),
+    )
+    return df, lacunas
+
+
+_INSERT_SQL = """
+INSERT INTO fipe_carros (
+    marca, modelo, ano_modelo, combustivel,
+    valor_str, valor, codigo_fipe,
+    sigla_combustivel, codigo_marca, codigo_modelo, codigo_ano
+) VALUES (
+    :marca, :modelo, :ano_modelo, :combustivel,
+    :valor_str, :valor, :codigo_fipe,
+    :sigla_combustivel, :codigo_marca, :codigo_modelo, :codigo_ano
+)
+ON CONFLICT (codigo_fipe, ano_modelo, combustivel)
+DO NOTHING
+"""
+
+_COLUNAS_INSERT = [
+    "marca", "modelo", "ano_modelo", "combustivel",
+    "valor_str", "valor", "codigo_fipe",
+    "sigla_combustivel", "codigo_marca", "codigo_modelo", "codigo_ano",
+]
+
+_QUARENTENA_SQL = """
+INSERT INTO fipe_carros_quarentena (registro, erro)
+VALUES (:registro, :erro)
+"""
+
+
+def _garantir_tabelas(conn):
+    from sqlalchemy import text
+    from sqlalchemy.exc import SQLAlchemyError
+
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS fipe_carros (
+        id SERIAL PRIMARY KEY,
+        marca VARCHAR(100),
+        modelo VARCHAR(150),
+        ano_modelo INTEGER,
+        combustivel VARCHAR(50),
+        valor_str VARCHAR(20),
+        valor FLOAT,
+        codigo_fipe VARCHAR(20),
+        sigla_combustivel VARCHAR(10),
+        data_consulta DATE DEFAULT CURRENT_DATE,
+        CONSTRAINT unique_fipe UNIQUE (codigo_fipe, ano_modelo, combustivel)
+    );
+    """))
+
+    conn.execute(text("""
+    ALTER TABLE fipe_carros
+    ALTER COLUMN data_consulta SET DEFAULT CURRENT_DATE
+    """))
+
+    conn.execute(text("""
+    ALTER TABLE fipe_carros
+        ADD COLUMN IF NOT EXISTS codigo_marca VARCHAR(20),
+        ADD COLUMN IF NOT EXISTS codigo_modelo VARCHAR(20),
+        ADD COLUMN IF NOT EXISTS codigo_ano VARCHAR(20)
+    """))
+
+    conn.execute(text("DROP INDEX IF EXISTS ix_fipe_carros_chave_api"))
+    conn.execute(text("""
+    CREATE INDEX IF NOT EXISTS ix_fipe_carros_codigos_api
+    ON fipe_carros (codigo_marca, codigo_modelo, codigo_ano)
+    """))
+
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_fipe_carros_modelo_trgm
+            ON fipe_carros USING gin (modelo gin_trgm_ops)
+            """))
+    except SQLAlchemyError as e:
+        logger.warning("pg_trgm indisponivel, busca por modelo usara apenas prefixo: %s", e)
+
+    conn.execute(text("""
+    CREATE INDEX IF NOT EXISTS ix_fipe_carros_modelo_prefixo
+    ON fipe_carros (lower(modelo) text_pattern_ops)
+    """))
+
+    conn.execute(text("""
+    CREATE INDEX IF NOT EXISTS ix_fipe_carros_codigo_fipe_prefixo
+    ON fipe_carros (codigo_fipe text_pattern_ops)
+    """))
+
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS fipe_carros_quarentena (
+        id SERIAL PRIMARY KEY,
+        registro TEXT,
+        erro TEXT,
+        criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """))
+
+
+def _inserir_isolando_falhas(engine, registros, quarentena):
+    """Insere ``registros`` em uma transacao propria.
+
+    Se o lote falhar por dados invalidos (``DataError`` ou ``IntegrityError``),
+    ele e dividido ao meio e cada metade e reenviada, ate que as linhas
+    invalidas fiquem isoladas em ``quarentena``. Os demais erros (conexao,
+    permissao, coluna ausente) nao dependem das linhas e sobem para o chamador.
+    """
+    from sqlalchemy import text
+    from sqlalchemy.exc import DataError, IntegrityError
+
+    try:
+        with engine.begin() as conn:
+            return conn.execute(text(_INSERT_SQL), registros).rowcount or 0
+    except (DataError, IntegrityError) as erro:
+        if len(registros) == 1:
+            quarentena.append((registros[0], erro))
+            return 0
+        meio = len(registros) // 2
+        return (
+            _inserir_isolando_falhas(engine, registros[:meio], quarentena)
+            + _inserir_isolando_falhas(engine, registros[meio:], quarentena)
         )
+
+
+def _enviar_para_quarentena(engine, quarentena):
+    from sqlalchemy import text
+
+    with engine.begin() as conn:
+        conn.execute(text(_QUARENTENA_SQL), [
+            {
+                "registro": json.dumps(registro, default=str, ensure_ascii=False),
+                "erro": str(getattr(erro, "orig", None) or erro)[:2000],
+            }
+            for registro, erro in quarentena
+        ])
+
+
+def _ajustar_batch(batch_size, duracao):
+    if duracao < _SAVE_TARGET_SECONDS / 2:
+        return min(batch_size * 2, _SAVE_BATCH_MAX)
+    if duracao > _SAVE_TARGET_SECONDS:
+        return max(batch_size // 2, _SAVE_BATCH_MIN)
+    return batch_size
+
+
+def _filtrar_validos(df):
+    import pandas as pd
+
+    df = df.copy()
+    for coluna in _COLUNAS_INSERT:
+        if coluna not in df:
+            df[coluna] = None
+    df["ano_modelo"] = df["ano_modelo"].apply(
+        lambda x: int(x) if pd.notna(x) else None
+    )
+    df["valor"] = df["valor"].where(pd.notna(df["valor"]), None)
+
+    return df[
+        df["codigo_fipe"].notna() &
+        df["ano_modelo"].notna() &
+        df["valor"].notna()
+    ]
+
+
+def salvar_no_banco(df, progress_callback=None, batch_size=None):
+    """Grava ``df`` em ``fipe_carros`` com commit por batch.
+
+    O tamanho do batch comeca em ``batch_size`` (ou ``FIPE_SAVE_BATCH_SIZE``) e
+    e ajustado pela latencia medida de cada ida ao banco. Linhas que o banco
+    rejeita vao para ``fipe_carros_quarentena`` sem desfazer o restante.
+    """
+    configurar_logging()
+    engine = get_engine()
+    with engine.begin() as conn:
+        _garantir_tabelas(conn)
+
+    if df.empty:
+        _emit(progress_callback, "save_empty", "Nenhum dado coletado. Tabela garantida.")
+        return {
+            "collected": 0,
+            "valid": 0,
+            "inserted": 0,
+            "existing": 0,
+            "quarantined": 0,
+        }
+
+    collected_count = len(df)
+    df = _filtrar_validos(df)
+
+    if df.empty:
+        _emit(progress_callback, "save_empty", "Nenhum dado valido apos filtros.")
         return {
             "collected": collected_count,
-            "valid": total_validos,
-            "inserted": total_inserido,
-            "existing": total_validos - total_inserido,
+            "valid": 0,
+            "inserted": 0,
+            "existing": 0,
+            "quarantined": 0,
         }
 
+    registros = df.to_dict(orient="records")
+    total_validos = len(registros)
+    batch_size = batch_size or _SAVE_BATCH_SIZE
+    total_inserido = 0
+    total_quarentena = 0
+    batch_number = 0
+    posicao = 0
 
-def importar_dados_fipe(limite_registros=None, progress_callback=None):
-    """Funcao principal: coleta e salva dados da FIPE."""
-    if limite_registros is None:
-        limite_registros = int(os.getenv("RECORDS_LIMIT", "600"))
-    _emit(progress_callback, "start", "Pipeline FIPE iniciado")
-    df = coletar_dados_fipe(limite_registros, progress_callback)
-    summary = salvar_no_banco(df, progress_callback)
     _emit(
         progress_callback,
-        "done",
-        "Pipeline FIPE concluido com sucesso",
-        current=limite_registros,
-        total=limite_registros,
-        summary=summary,
+        "save_start",
+        f"Salvando {total_validos} registros (batch inicial: {batch_size})",
+        current=0,
+        total=total_validos,
     )
-    return summary
+
+    while posicao < total_validos:
+        lote = registros[posicao:posicao + batch_size]
+        batch_number += 1
+        quarentena = []
+        inicio = time.perf_counter()
+        try:
+            inserted_batch = _inserir_isolando_falhas(engine, lote, quarentena)
+        except Exception as e:
+            _emit(
+                progress_callback,
+                "save_error",
+                (
+                    f"Erro no batch {batch_number}: {e}. "
+                    f"{total_inserido} registros ja gravados foram mantidos."
+                ),
+                current=posicao,
+                total=total_validos,
+            )
+            raise
+        duracao = time.perf_counter() - inicio
+
+        if quarentena:
+            _enviar_para_quarentena(engine, quarentena)
+            total_quarentena += len(quarentena)
+        else:
+            batch_size = _ajustar_batch(batch_size, duracao)
+
+        posicao += len(lote)
+        total_inserido += inserted_batch
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Batch %d: %d registros processados em %.0f ms",
+                batch_number,
+                len(lote),
+                duracao * 1000,
+            )
+        if callable(progress_callback):
+            progress_callback({
+                "event": "save_batch",
+                "message": (
+                    f"Batch {batch_number}: {inserted_batch} novos, "
+                    f"{len(lote) - inserted_batch - len(quarentena)} ja existentes, "
+                    f"{len(quarentena)} em quarentena ({duracao * 1000:.0f} ms)"
+                ),
+                "current": posicao,
+                "total": total_validos,
+                "inserted": total_inserido,
+                "existing": posicao - total_inserido - total_quarentena,
+                "quarantined": total_quarentena,
+            })
+
+    total_existentes = total_validos - total_inserido - total_quarentena
+    _emit(
+        progress_callback,
+        "save_done",
+        (
+            f"Insercao finalizada: {total_inserido} novos, "
+            f"{total_existentes} ja existentes, {total_quarentena} em quarentena"
+        ),
+        current=total_validos,
+        total=total_validos,
+        collected=collected_count,
+        valid=total_validos,
+        inserted=total_inserido,
+        existing=total_existentes,
+        quarantined=total_quarentena,
+    )
+    return {
+        "collected": collected_count,
+        "valid": total_validos,
+        "inserted": total_inserido,
+        "existing": total_existentes,
+        "quarantined": total_quarentena,
+    }
+
+
+def _blocos_csv(validos, tamanho):
+    """Blocos CSV de ``_COLUNAS_INSERT`` no formato do ``COPY``."""
+    # um ano nulo antes do filtro deixa a coluna em float64, e "2020.0" nao entra em INTEGER
+    linhas = validos[_COLUNAS_INSERT].astype({"ano_modelo": "Int64"})
+    for posicao in range(0, len(linhas), tamanho):
+        buffer = io.StringIO()
+        linhas.iloc[posicao:posicao + tamanho].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        yield buffer
+
+
+def copiar_para_o_banco(df, progress_callback=None, batch_size=None):
+    """Grava ``df`` em ``fipe_carros`` com ``COPY`` e um unico ``INSERT ... SELECT``.
+
+    As linhas validas vao para uma tabela temporaria via ``COPY`` e entram em
+    ``fipe_carros`` com ``ON CONFLICT DO NOTHING``, tudo em uma transacao.
+    Feito para a reconstrucao a partir do cache, que regrava o cache inteiro de
+    uma vez. Se o banco rejeitar alguma linha, a transacao e desfeita e a
+    gravacao cai para ``salvar_no_banco``, que isola as linhas em quarentena.
+    """
+    import psycopg2
+
+    configurar_logging()
+    engine = get_engine()
+    with engine.begin() as conn:
+        _garantir_tabelas(conn)
+
+    validos = _filtrar_validos(df) if not df.empty else df
+    if validos.empty:
+        return salvar_no_banco(df, progress_callback, batch_size=batch_size)
+
+    total_validos = len(validos)
+    _emit(
+        progress_callback,
+        "save_start",
+        f"Copiando {total_validos} registros para o banco",
+        current=0,
+        total=total_validos,
+    )
+
+    colunas = ", ".join(_COLUNAS_INSERT)
+    inicio = time.perf_counter()
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMP TABLE fipe_carros_replay ON COMMIT DROP AS "
+                f"SELECT {colunas} FROM fipe_carros WITH NO DATA"
+            )
+            for buffer in _blocos_csv(validos, _REPLAY_COPY_CHUNK):
+                cursor.copy_expert(f"COPY fipe_carros_replay ({colunas}) FROM STDIN WITH (FORMAT csv)", buffer)
+            cursor.execute(f"""
+                INSERT INTO fipe_carros ({colunas})
+                SELECT {colunas} FROM fipe_carros_replay
+                ON CONFLICT (codigo_fipe, ano_modelo, combustivel) DO NOTHING
+            """)
+            total_inserido = cursor.rowcount
+        raw.commit()
+    except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+        raw.rollback()
+        logger.warning("COPY do replay rejeitado, usando gravacao em batches: %s", e)
+        _emit(progress_callback, "save_fallback", f"COPY rejeitado ({e}); gravando em batches com quarentena")
+        return salvar_no_banco(df, progress_callback, batch_size=batch_size)
+    finally:
+        raw.close()
+
+    duracao = time.perf_counter() - inicio
+    total_existentes = total_validos - total_inserido
+    _emit(
+        progress_callback,
+        "save_done",
+        (
+            f"Insercao finalizada: {total_inserido} novos, "
+            f"{total_existentes} ja existentes, 0 em quarentena ({duracao * 1000:.0f} ms)"
+        ),
+        current=total_validos,
+        total=total_validos,
+        collected=len(df),
+        valid=total_validos,
+        inserted=total_inserido,
+        existing=total_existentes,
+        quarantined=0,
+    )
+    return {
+        "collected": len(df),
+        "valid": total_validos,
+        "inserted": total_inserido,
+        "existing": total_existentes,
+        "quarantined": 0,
+    }
+
+
+def _atualizar_depreciacao(df, progress_callback=None):
+    from sqlalchemy.exc import SQLAlchemyError
+
+    from app.pipeline.depreciacao import atualizar_curvas_depreciacao
+
+    if df.empty:
+        return 0
+    _emit(progress_callback, "analytics_start", "Atualizando curvas de depreciacao")
+    try:
+        total = atualizar_curvas_depreciacao(df)
+    except SQLAlchemyError as e:
+        _emit(progress_callback, "analytics_error", f"Erro ao atualizar curvas de depreciacao: {e}")
+        return 0
+    _emit(progress_callback, "analytics_done", f"{total} pontos de curva de depreciacao atualizados")
+    return total
+
+
+def importar_dados_fipe(
+    limite_registros=None,
+    progress_callback=None,
+    modo=None,
+    cota_por_marca=None,
+    max_workers=None,
+    batch_size=None,
+    prazo_segundos=None,
+):
+    """Funcao principal: coleta e salva dados da FIPE.
+
+    Com ``prazo_segundos``, a coleta recebe o prazo menos a fracao
+    ``FIPE_TIME_BUDGET_SAVE_FRACTION`` reservada para gravar no banco. Se o
+    prazo acabar, as curvas de depreciacao nao sao recalculadas nesta execucao
+    (``summary["curves_deferred"]``); ``python -m app.cli curvas`` as refaz.
+    """
+    with contexto_execucao("importar") as run_id:
+        if limite_registros is None:
+            limite_registros = int(os.getenv("RECORDS_LIMIT", "600"))
+        if prazo_segundos is None and _TIME_BUDGET:
+            prazo_segundos = float(_TIME_BUDGET)
+        inicio = time.monotonic()
+        _emit(progress_callback, "start", "Pipeline FIPE iniciado")
+        df = coletar_dados_fipe(
+            limite_registros,
+            progress_callback,
+            modo=modo,
+            cota_por_marca=cota_por_marca,
+            max_workers=max_workers,
+            prazo_segundos=prazo_segundos * (1 - _TIME_BUDGET_SAVE_FRACTION) if prazo_segundos else None,
+        )
+        summary = salvar_no_banco(df, progress_callback, batch_size=batch_size)
+        summary["run_id"] = run_id
+        summary["skipped"] = df.attrs.get("skipped", 0)
+        summary["deadline_reached"] = df.attrs.get("deadline_reached", False)
+        summary["curves_deferred"] = bool(prazo_segundos) and (
+            summary["deadline_reached"] or time.monotonic() - inicio >= prazo_segundos
+        )
+        if summary["curves_deferred"]:
+            summary["curves"] = 0
+            _emit(
+                progress_callback,
+                "analytics_deferred",
+                "Prazo esgotado: curvas de depreciacao adiadas (python -m app.cli curvas)",
+            )
+        else:
+            summary["curves"] = _atualizar_depreciacao(df, progress_callback)
+        _emit(
+            progress_callback,
+            "done",
+            "Pipeline FIPE concluido com sucesso",
+            current=limite_registros,
+            total=limite_registros,
+            summary=summary,
+        )
+        return summary
+
+
+def importar_dados_do_cache(progress_callback=None, batch_size=None):
+    """Recarrega o banco a partir do cache local, sem consumir a API FIPE."""
+    with contexto_execucao("replay") as run_id:
+        _emit(progress_callback, "start", "Reconstrucao a partir do cache iniciada")
+        df, lacunas = coletar_dados_do_cache(progress_callback)
+        summary = copiar_para_o_banco(df, progress_callback, batch_size=batch_size)
+        summary["run_id"] = run_id
+        summary["curves"] = _atualizar_depreciacao(df, progress_callback)
+        summary["gaps"] = {
+            chave: len(valor) if isinstance(valor, list) else valor
+            for chave, valor in lacunas.items()
+        }
+        _emit(
+            progress_callback,
+            "done",
+            "Reconstrucao a partir do cache concluida",
+            summary=summary,
+        )
+        return summary
 
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+import io
+from datetime import datetime
+from pathlib import Path
+
+from app.db.engine import get_engine
+
+# (marca, participacao aproximada no catalogo FIPE, fator de preco, familias de modelos)
+MARCAS = [
+    ("Chevrolet", 0.120, 1.00, ["Onix", "Prisma", "Cruze", "S10", "Tracker", "Celta", "Corsa", "Spin"]),
+    ("VW - VolksWagen", 0.120, 1.05, ["Gol", "Polo", "Virtus", "T-Cross", "Saveiro", "Fox", "Jetta", "Amarok"]),
+    ("Fiat", 0.100, 0.90, ["Uno", "Palio", "Argo", "Mobi", "Strada", "Toro", "Siena", "Pulse"]),
+    ("Ford", 0.075, 1.00, ["Ka", "Fiesta", "Focus", "EcoSport", "Ranger", "Fusion"]),
+    ("Renault", 0.055, 0.95, ["Sandero", "Logan", "Duster", "Kwid", "Clio", "Oroch"]),
+    ("Toyota", 0.045, 1.45, ["Corolla", "Etios", "Hilux", "Yaris", "SW4", "RAV4"]),
+    ("Hyundai", 0.040, 1.20, ["HB20", "Creta", "Tucson", "ix35", "Azera"]),
+    ("Honda", 0.035, 1.35, ["Civic", "Fit", "City", "HR-V", "CR-V", "WR-V"]),
+    ("Nissan", 0.030, 1.10, ["Kicks", "March", "Versa", "Sentra", "Frontier"]),
+    ("Peugeot", 0.030, 1.00, ["208", "2008", "206", "207", "3008", "Partner"]),
+    ("Citroën", 0.025, 0.95, ["C3", "C4", "Aircross", "Xsara", "Berlingo"]),
+    ("Mitsubishi", 0.025, 1.45, ["L200", "Pajero", "ASX", "Outlander", "Lancer"]),
+    ("Jeep", 0.020, 1.60, ["Renegade", "Compass", "Commander", "Wrangler", "Cherokee"]),
+    ("Kia Motors", 0.020, 1.20, ["Sportage", "Cerato", "Picanto", "Sorento", "Soul"]),
+    ("Mercedes-Benz", 0.030, 3.20, ["Classe C", "Classe A", "Classe E", "GLA", "GLC", "Sprinter"]),
+    ("BMW", 0.030, 3.00, ["320i", "X1", "X3", "X5", "118i", "530i"]),
+    ("Audi", 0.025, 3.00, ["A3", "A4", "Q3", "Q5", "A5", "Q7"]),
+    ("Volvo", 0.012, 3.00, ["XC40", "XC60", "XC90", "S60", "V40"]),
+    ("Land Rover", 0.012, 3.80, ["Discovery", "Evoque", "Defender", "Velar"]),
+    ("Porsche", 0.010, 6.50, ["Cayenne", "Macan", "911", "Panamera"]),
+    ("Suzuki", 0.012, 1.10, ["Vitara", "Jimny", "Swift", "S-Cross"]),
+    ("Chery", 0.010, 0.85, ["QQ", "Celer", "Tiggo 2", "Face"]),
+    ("JAC", 0.008, 0.90, ["J3", "J5", "T40", "T60"]),
+    ("Subaru", 0.008, 1.40, ["Forester", "Impreza", "XV", "Outback"]),
+    ("Jaguar", 0.006, 3.50, ["F-Pace", "XE", "XF", "E-Pace"]),
+    ("Lexus", 0.005, 3.20, ["NX", "UX", "RX", "ES"]),
+    ("Mini", 0.006, 2.20, ["Cooper", "Countryman", "Clubman"]),
+    ("Dodge", 0.008, 1.80, ["Journey", "Durango", "Ram 2500", "Challenger"]),
+    ("RAM", 0.005, 2.60, ["Rampage", "1500", "2500", "Classic"]),
+    ("BYD", 0.006, 1.70, ["Dolphin", "Song Plus", "Seal", "Yuan Plus"]),
+    ("GWM", 0.004, 1.80, ["Haval H6", "Ora 03", "Poer"]),
+    ("Caoa Chery", 0.006, 1.10, ["Tiggo 5X", "Tiggo 7", "Tiggo 8", "Arrizo 6"]),
+    ("Troller", 0.003, 1.70, ["T4", "Pantanal"]),
+    ("Agrale", 0.002, 1.30, ["Marrua", "Marrua AM200"]),
+    ("Acura", 0.002, 1.20, ["Integra", "Legend", "NSX"]),
+    ("Alfa Romeo", 0.003, 1.60, ["Giulia", "156", "164", "Stelvio"]),
+    ("Asia Motors", 0.002, 0.80, ["Topic", "Towner", "Hi-Topic"]),
+    ("Lada", 0.002, 0.50, ["Niva", "Laika", "Samara"]),
+    ("Gurgel", 0.001, 0.50, ["BR-800", "Supermini", "X-12"]),
+    ("Ferrari", 0.003, 12.00, ["Roma", "296 GTB", "F8", "Portofino"]),
+    ("Lamborghini", 0.002, 14.00, ["Urus", "Huracan", "Aventador"]),
+    ("Maserati", 0.002, 6.00, ["Ghibli", "Levante", "Quattroporte"]),
+]
+
+MOTORES = ["1.0", "1.0 Turbo", "1.3", "1.4", "1.5", "1.6", "1.8", "2.0", "2.0 Turbo", "2.8", "3.0", "3.5 V6", "4.0 V8"]
+VERSOES = ["", "LT", "LTZ", "Comfortline", "Highline", "Attractive", "Sport", "EX", "EXL", "SE", "Limited", "Premium"]
+PORTAS = ["2p", "4p"]
+
+COMBUSTIVEIS = ["Gasolina", "Álcool", "Diesel", "Flex", "Elétrico", "Híbrido"]
+SIGLAS = ["G", "A", "D", "F", "E", "H"]
+# probabilidades de combustivel por era do ano de lancamento
+_COMBUSTIVEL_ANTES_1995 = [0.62, 0.30, 0.08, 0.00, 0.00, 0.00]
+_COMBUSTIVEL_1995_2003 = [0.85, 0.05, 0.10, 0.00, 0.00, 0.00]
+_COMBUSTIVEL_DEPOIS_2003 = [0.14, 0.00, 0.09, 0.70, 0.03, 0.04]
+
+ANO_INICIAL = 1985
+
+
+def _formatar_valor(valores):
+    return [
+        f"R$ {valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+        for valor in valores
+    ]
+
+
+def gerar_dados_sinteticos(linhas, seed=42):
+    """Gera cerca de ``linhas`` registros com o formato de ``fipe_carros``.
+
+    Marcas seguem a participacao aproximada do catalogo FIPE; cada modelo tem
+    um ano de lancamento concentrado nos anos recentes, de 1 a 20 anos-modelo
+    consecutivos, um combustivel coerente com a epoca e preco que cai com a
+    idade ate estabilizar. Os codigos FIPE comecam com ``S`` para nunca
+    colidir com dados reais.
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    ano_atual = datetime.now().year
+
+    spans = rng.geometric(0.12, size=max(1, int(linhas / 7) + 1)).clip(1, 20)
+    spans = spans[: np.searchsorted(np.cumsum(spans), linhas) + 1]
+    n_modelos = len(spans)
+
+    pesos = np.array([peso for _, peso, _, _ in MARCAS])
+    marca_idx = rng.choice(len(MARCAS), size=n_modelos, p=pesos / pesos.sum())
+    fator_marca = np.array([fator for _, _, fator, _ in MARCAS])[marca_idx]
+
+    # lancamentos concentrados nos ultimos anos, como no catalogo real
+    lancamento = ano_atual - np.floor(rng.beta(1.2, 2.5, size=n_modelos) * (ano_atual - ANO_INICIAL)).astype(int)
+    lancamento = np.minimum(lancamento, ano_atual - spans + 1).clip(ANO_INICIAL, ano_atual)
+
+    combustivel_idx = np.where(
+        lancamento < 1995,
+        rng.choice(6, size=n_modelos, p=_COMBUSTIVEL_ANTES_1995),
+        np.where(
+            lancamento < 2003,
+            rng.choice(6, size=n_modelos, p=_COMBUSTIVEL_1995_2003),
+            rng.choice(6, size=n_modelos, p=_COMBUSTIVEL_DEPOIS_2003),
+        ),
+    )
+
+    nomes_marca = np.array([nome for nome, _, _, _ in MARCAS])[marca_idx]
+    n_familias = np.array([len(familias) for _, _, _, familias in MARCAS])[marca_idx]
+    familia_idx = (rng.random(n_modelos) * n_familias).astype(int)
+    nomes_modelo = [
+        f"{familia} {MOTORES[m]} {VERSOES[v]} {PORTAS[p]}".replace("  ", " ")
+        for familia, m, v, p in zip(
+            [MARCAS[i][3][f] for i, f in zip(marca_idx, familia_idx)],
+            rng.integers(len(MOTORES), size=n_modelos),
+            rng.integers(len(VERSOES), size=n_modelos),
+            rng.integers(len(PORTAS), size=n_modelos),
+        )
+    ]
+    codigos = [f"S{i:06d}-{i % 9}" for i in range(n_modelos)]
+    preco_novo = rng.lognormal(np.log(65000), 0.45, size=n_modelos) * fator_marca
+
+    modelo_de_cada_linha = np.repeat(np.arange(n_modelos), spans)
+    deslocamento = np.arange(len(modelo_de_cada_linha)) - np.repeat(np.cumsum(spans) - spans, spans)
+    ano_modelo = lancamento[modelo_de_cada_linha] + deslocamento
+    idade = ano_atual - ano_modelo
+    depreciacao = (0.2 + 0.8 * 0.86 ** idade) * rng.normal(1.0, 0.04, size=len(ano_modelo)).clip(0.85, 1.15)
+    valor = np.round(preco_novo[modelo_de_cada_linha] * depreciacao, 0)
+
+    df = pd.DataFrame({
+        "marca": nomes_marca[modelo_de_cada_linha],
+        "modelo": np.array(nomes_modelo, dtype=object)[modelo_de_cada_linha],
+        "ano_modelo": ano_modelo,
+        "combustivel": np.array(COMBUSTIVEIS)[combustivel_idx][modelo_de_cada_linha],
+        "valor": valor,
+        "codigo_fipe": np.array(codigos, dtype=object)[modelo_de_cada_linha],
+        "sigla_combustivel": np.array(SIGLAS)[combustivel_idx][modelo_de_cada_linha],
+    }).head(linhas)
+    df.insert(4, "valor_str", _formatar_valor(df["valor"]))
+    df.insert(0, "id", np.arange(1, len(df) + 1))
+    df["data_consulta"] = pd.Timestamp.now().normalize()
+    return df
+
+
+def salvar_snapshot(df, caminho):
+    caminho = Path(caminho)
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    if caminho.suffix == ".pkl":
+        df.to_pickle(caminho)
+    else:
+        df.to_csv(caminho, index=False)
+    return caminho
+
+
+def ler_snapshot(caminho):
+    import pandas as pd
+
+    caminho = Path(caminho)
+    if caminho.suffix == ".pkl":
+        return pd.read_pickle(caminho)
+    return pd.read_csv(caminho, dtype={"codigo_fipe": str}, parse_dates=["data_consulta"])
+
+
+def carregar_sinteticos_no_banco(df, engine=None, chunk_size=200000):
+    """Substitui as linhas sinteticas de ``fipe_carros`` usando ``COPY``.
+
+    Remove antes os registros com codigo FIPE iniciado em ``S``; dados reais
+    nao sao tocados. A remocao e o ``COPY`` rodam na mesma transacao, entao uma
+    carga que falha deixa as linhas sinteticas anteriores no lugar.
+    """
+    from sqlalchemy import text
+
+    from app.pipeline.fipe_import import _garantir_tabelas
+
+    colunas = [
+        "marca", "modelo", "ano_modelo", "combustivel", "valor_str",
+        "valor", "codigo_fipe", "sigla_combustivel", "data_consulta",
+    ]
+    copy_sql = f"COPY fipe_carros ({', '.join(colunas)}) FROM STDIN WITH (FORMAT csv)"
+    engine = engine or get_engine()
+    with engine.begin() as conn:
+        _garantir_tabelas(conn)
+        conn.execute(text("DELETE FROM fipe_carros WHERE codigo_fipe LIKE 'S%'"))
+        with conn.connection.dbapi_connection.cursor() as cursor:
+            for inicio in range(0, len(df), chunk_size):
+                buffer = io.StringIO()
+                df[colunas].iloc[inicio:inicio + chunk_size].to_csv(buffer, index=False, header=False)
+                buffer.seek(0)
+                cursor.copy_expert(copy_sql, buffer)
+    return len(df)
@@ -1,20 +1,118 @@
+import atexit
+import json
 import logging
-from datetime import datetime
+import os
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
 from pathlib import Path
 
-LOG_DIR = Path("logs")
-LOG_DIR.mkdir(parents=True, exist_ok=True)
+LOG_DIR = Path(os.getenv("FIPE_LOG_DIR", "logs"))
+LOG_FILE = os.getenv("FIPE_LOG_FILE", "logs.jsonl")
+LOG_LEVEL = os.getenv("FIPE_LOG_LEVEL", "INFO").upper()
+LOG_CONSOLE_LEVEL = os.getenv("FIPE_LOG_CONSOLE_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(os.getenv("FIPE_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("FIPE_LOG_BACKUPS", "5"))
 
-logging.basicConfig(
-    filename=LOG_DIR / "logs.txt",
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+_contexto_execucao = ContextVar("contexto_execucao", default={})
+_listener = None
+_config_lock = threading.Lock()
+
+_ATRIBUTOS_LOG_RECORD = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+    "run_id",
+    "job",
+}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        dados = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "run_id": getattr(record, "run_id", None),
+            "job": getattr(record, "job", None),
+            "msg": record.getMessage(),
+        }
+        for chave, valor in vars(record).items():
+            if chave not in _ATRIBUTOS_LOG_RECORD:
+                dados[chave] = valor
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+class _ContextoExecucaoFilter(logging.Filter):
+    def filter(self, record):
+        contexto = _contexto_execucao.get()
+        record.run_id = contexto.get("run_id")
+        record.job = contexto.get("job")
+        return True
+
+
+def configurar_logging():
+    """Configura o logger ``fipe`` na primeira chamada.
+
+    As mensagens entram em uma fila em memoria e um unico thread de fundo
+    grava o arquivo JSON-lines rotativo e o console, entao quem registra o
+    log nunca espera por I/O.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    with _config_lock:
+        if _listener is not None:
+            return
+
+        import queue
+        from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+        arquivo = RotatingFileHandler(
+            LOG_DIR / LOG_FILE,
+            maxBytes=LOG_MAX_BYTES,
+            backupCount=LOG_BACKUPS,
+            encoding="utf-8",
+        )
+        arquivo.setFormatter(JsonLinesFormatter())
+
+        console = logging.StreamHandler(sys.stderr)
+        console.setFormatter(logging.Formatter("%(message)s"))
+        console.setLevel(LOG_CONSOLE_LEVEL)
+
+        fila = queue.SimpleQueue()
+        handler = QueueHandler(fila)
+        handler.addFilter(_ContextoExecucaoFilter())
+
+        logger = logging.getLogger("fipe")
+        logger.setLevel(LOG_LEVEL)
+        logger.addHandler(handler)
+        logger.propagate = False
+
+        listener = QueueListener(fila, arquivo, console, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        _listener = listener
+
+
+@contextmanager
+def contexto_execucao(job, run_id=None):
+    """Marca todas as linhas de log emitidas no bloco com ``run_id`` e ``job``."""
+    run_id = run_id or uuid.uuid4().hex[:12]
+    token = _contexto_execucao.set({"run_id": run_id, "job": job})
+    try:
+        yield run_id
+    finally:
+        _contexto_execucao.reset(token)
 
 
 def log(msg):
-    logging.info(msg)
-    print(msg)
+    configurar_logging()
+    logging.getLogger("fipe").info(msg)
 
 
 def validar_ano(ano):
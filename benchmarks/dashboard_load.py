@@ -0,0 +1,169 @@
+"""Mede o custo do dashboard com volumes crescentes de dados sinteticos.
+
+Para cada escala o script gera (ou le de um snapshot) registros com o formato
+de ``fipe_carros`` e cronometra as etapas que uma sessao do dashboard executa:
+carga fria, ``prepare_data``, filtros do sidebar, os quatro graficos e a
+tabela. Tambem reporta a memoria do DataFrame e o pico alocado na sessao.
+
+Exemplos::
+
+    python benchmarks/dashboard_load.py --escalas 10000 100000 1000000
+    python benchmarks/dashboard_load.py --escalas 500000 --banco
+    python benchmarks/dashboard_load.py --escalas 2000000 --json resultado.json
+"""
+
+import argparse
+import gc
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from app.dashboard.charts import price_by_brand, price_by_fuel, price_by_year, price_distribution
+from app.dashboard.filters import filter_by_brands, filter_data, prepare_data
+from app.pipeline.sintetico import gerar_dados_sinteticos, ler_snapshot, salvar_snapshot
+
+COLUNAS_TABELA = ["marca", "modelo", "ano_modelo", "combustivel", "valor_str", "codigo_fipe", "data_consulta"]
+
+
+def _cronometrar(funcao, repeticoes=1):
+    tempos = []
+    resultado = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return resultado, sorted(tempos)[len(tempos) // 2]
+
+
+def _selecoes_tipicas(df):
+    marcas = df["marca"].value_counts().index.tolist()
+    combustiveis = sorted(df["combustivel"].unique())
+    anos = (int(df["ano_modelo"].min()), int(df["ano_modelo"].max()))
+    return {
+        "tudo": (marcas, combustiveis, anos),
+        "uma_marca": (marcas[:1], combustiveis, anos),
+        "tres_marcas_flex": (marcas[:3], ["Flex"], anos),
+        "ultimos_5_anos": (marcas, combustiveis, (anos[1] - 4, anos[1])),
+    }
+
+
+def _opcoes_sidebar(df, marcas):
+    base = filter_by_brands(df, marcas)
+    return sorted(df["marca"].unique()), sorted(base["combustivel"].unique())
+
+
+def _carregar_do_banco(linhas):
+    from app.dashboard.queries import get_engine, load_fipe_data
+    from app.pipeline.sintetico import carregar_sinteticos_no_banco
+
+    engine = get_engine()
+    carregar_sinteticos_no_banco(gerar_dados_sinteticos(linhas), engine)
+    return lambda: load_fipe_data(engine)
+
+
+def _medir_etapas(carregar, repeticoes):
+    # os DataFrames da sessao so vivem aqui, e saem de memoria antes de medir o pico
+    bruto, carga = _cronometrar(carregar)
+    df, preparo = _cronometrar(lambda: prepare_data(bruto))
+
+    filtros = {}
+    graficos = {}
+    tabela = 0.0
+    for nome, (marcas, combustiveis, anos) in _selecoes_tipicas(df).items():
+        _, opcoes = _cronometrar(lambda: _opcoes_sidebar(df, marcas), repeticoes)
+        filtrado, filtro = _cronometrar(lambda: filter_data(df, marcas, combustiveis, anos), repeticoes)
+        filtros[nome] = round((opcoes + filtro) * 1000, 2)
+        if nome == "tudo":
+            for grafico in (price_by_brand, price_by_year, price_by_fuel, price_distribution):
+                _, tempo = _cronometrar(lambda: grafico(filtrado))
+                graficos[grafico.__name__] = round(tempo * 1000, 2)
+            _, tabela = _cronometrar(lambda: filtrado[COLUNAS_TABELA].head(100), repeticoes)
+
+    return {
+        "linhas": len(df),
+        "carga_fria_s": round(carga, 3),
+        "preparo_s": round(preparo, 3),
+        "filtros_ms": filtros,
+        "graficos_ms": graficos,
+        "tabela_ms": round(tabela * 1000, 2),
+        "memoria_df_mb": round(df.memory_usage(deep=True).sum() / 2**20, 1),
+    }
+
+
+def medir_escala(linhas, pasta, banco=False, repeticoes=3):
+    if banco:
+        carregar = _carregar_do_banco(linhas)
+    else:
+        snapshot = salvar_snapshot(gerar_dados_sinteticos(linhas), Path(pasta) / f"fipe_{linhas}.pkl")
+        carregar = lambda: ler_snapshot(snapshot)
+    gc.collect()
+
+    resultado = _medir_etapas(carregar, repeticoes)
+    gc.collect()
+    resultado["pico_sessao_mb"] = round(_pico_sessao(carregar) / 2**20, 1)
+    return resultado
+
+
+def _aquecer():
+    # a primeira figura do processo paga a inicializacao do Plotly
+    df = prepare_data(gerar_dados_sinteticos(1000))
+    for grafico in (price_by_brand, price_by_year, price_by_fuel, price_distribution):
+        grafico(df)
+
+
+def _pico_sessao(carregar):
+    # passada separada: o tracemalloc deixa as etapas cronometradas mais lentas
+    tracemalloc.start()
+    df = prepare_data(carregar())
+    marcas, combustiveis, anos = _selecoes_tipicas(df)["tudo"]
+    filtrado = filter_data(df, marcas, combustiveis, anos)
+    for grafico in (price_by_brand, price_by_year, price_by_fuel, price_distribution):
+        grafico(filtrado)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return pico
+
+
+CABECALHO = f"{'linhas':>10} {'carga s':>8} {'prep s':>7} {'filtro ms':>10} {'graficos ms':>12} {'df MB':>8} {'pico MB':>8}"
+
+
+def _imprimir_linha(r):
+    print(
+        f"{r['linhas']:>10} {r['carga_fria_s']:>8} {r['preparo_s']:>7} "
+        f"{max(r['filtros_ms'].values()):>10} {sum(r['graficos_ms'].values()):>12.1f} "
+        f"{r['memoria_df_mb']:>8} {r['pico_sessao_mb']:>8}",
+        flush=True,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--escalas", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--banco", action="store_true",
+                        help="Grava as linhas em fipe_carros e mede a carga via load_fipe_data")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--json", help="Grava os resultados completos neste arquivo")
+    args = parser.parse_args(argv)
+
+    _aquecer()
+    print(CABECALHO)
+    print("-" * len(CABECALHO))
+    resultados = []
+    with tempfile.TemporaryDirectory() as pasta:
+        for linhas in args.escalas:
+            resultados.append(medir_escala(linhas, pasta, args.banco, args.repeticoes))
+            _imprimir_linha(resultados[-1])
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(resultados, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Verifica que os modulos da pipeline e do banco importam sem trabalho pesado.
+
+Cada modulo e importado em um interpretador novo, dentro de uma pasta
+temporaria sem ``.env`` e sem ``DATABASE_URL``. O script falha (codigo de
+saida 1) se o import carregar pandas, numpy, requests, SQLAlchemy ou dotenv,
+criar arquivos, ler o cache da API, configurar o logging ou passar do tempo
+limite.
+
+Exemplos::
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --limite-ms 30 --repeticoes 9 --json importacao.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+MODULOS = [
+    "app.utils.funcoes",
+    "app.db.engine",
+    "app.pipeline.depreciacao",
+    "app.pipeline.fipe_import",
+    "app.pipeline.backfill",
+    "app.pipeline.sintetico",
+    "app.cli",
+]
+PESADOS = ["pandas", "numpy", "requests", "sqlalchemy", "dotenv"]
+
+_SCRIPT = """
+import importlib, json, logging, os, sys, time
+sys.path.insert(0, {raiz!r})
+antes = set(os.listdir("."))
+inicio = time.perf_counter()
+modulo = importlib.import_module({modulo!r})
+duracao = time.perf_counter() - inicio
+print(json.dumps({{
+    "ms": duracao * 1000,
+    "pesados": sorted({{nome.split(".")[0] for nome in sys.modules}} & set({pesados!r})),
+    "arquivos": sorted(set(os.listdir(".")) - antes),
+    "cache_lido": getattr(sys.modules.get("app.pipeline.fipe_import"), "_cache_loaded", False),
+    "logging": bool(logging.getLogger("fipe").handlers),
+}}))
+"""
+
+
+def medir_modulo(modulo, pasta, repeticoes):
+    env = {chave: valor for chave, valor in os.environ.items() if chave != "DATABASE_URL"}
+    script = _SCRIPT.format(raiz=str(PROJECT_ROOT), modulo=modulo, pesados=PESADOS)
+    medicoes = []
+    for _ in range(repeticoes):
+        saida = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=pasta,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        medicoes.append(json.loads(saida.stdout.strip().splitlines()[-1]))
+
+    resultado = medicoes[-1]
+    resultado["ms"] = round(sorted(m["ms"] for m in medicoes)[len(medicoes) // 2], 2)
+    return resultado
+
+
+def problemas(resultado, limite_ms):
+    encontrados = []
+    if resultado["pesados"]:
+        encontrados.append("importa " + ", ".join(resultado["pesados"]))
+    if resultado["arquivos"]:
+        encontrados.append("cria " + ", ".join(resultado["arquivos"]))
+    if resultado["cache_lido"]:
+        encontrados.append("le o cache da API")
+    if resultado["logging"]:
+        encontrados.append("configura o logging")
+    if resultado["ms"] > limite_ms:
+        encontrados.append(f"leva {resultado['ms']} ms (limite {limite_ms} ms)")
+    return encontrados
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--limite-ms", type=float, default=50.0, help="Tempo maximo de import por modulo (mediana)")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--json", help="Grava os resultados completos neste arquivo")
+    args = parser.parse_args(argv)
+
+    resultados = {}
+    falhou = False
+    with tempfile.TemporaryDirectory() as pasta:
+        for modulo in MODULOS:
+            resultado = medir_modulo(modulo, pasta, args.repeticoes)
+            resultados[modulo] = resultado
+            erros = problemas(resultado, args.limite_ms)
+            falhou = falhou or bool(erros)
+            status = "; ".join(erros) if erros else "ok"
+            print(f"{modulo:<28} {resultado['ms']:>8.2f} ms  {status}", flush=True)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(resultados, indent=2), encoding="utf-8")
+    return 1 if falhou else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""Verifica que o replay do cache grava pelo ``COPY``, sem cair nos batches.
+
+Monta um cache temporario com um detalhe zero-km (``AnoModelo: 32000``, como
+nos caches reais da FIPE), reconstroi os registros com
+``coletar_dados_do_cache`` e confere que os blocos CSV do ``COPY`` trazem
+``ano_modelo`` como inteiro. Com ``--banco``, grava as linhas em
+``fipe_carros`` (codigos FIPE iniciados em ``S``, removidos no final) e falha
+se ``copiar_para_o_banco`` precisar do caminho de fallback. O script sai com
+codigo 1 em qualquer falha.
+
+Exemplos::
+
+    python benchmarks/replay_copy.py
+    python benchmarks/replay_copy.py --banco
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+CACHE = {
+    "marcas": [{"codigo": "1", "nome": "Marca Teste"}],
+    "modelos:1": [{"codigo": 10, "nome": "Modelo Teste"}],
+    "anos:1:10": [{"codigo": "32000-1"}, {"codigo": "2020-1"}],
+    "detalhes:1:10:32000-1": {
+        "Valor": "R$ 120.000,00", "AnoModelo": 32000, "CodigoFipe": "S99999-1",
+        "Combustivel": "Gasolina", "SiglaCombustivel": "G",
+    },
+    "detalhes:1:10:2020-1": {
+        "Valor": "R$ 80.000,00", "AnoModelo": 2020, "CodigoFipe": "S99999-1",
+        "Combustivel": "Gasolina", "SiglaCombustivel": "G",
+    },
+}
+
+
+def verificar_csv(fipe_import):
+    df, _ = fipe_import.coletar_dados_do_cache()
+    validos = fipe_import._filtrar_validos(df)
+    indice = fipe_import._COLUNAS_INSERT.index("ano_modelo")
+    anos = [
+        linha[indice]
+        for buffer in fipe_import._blocos_csv(validos, 1000)
+        for linha in csv.reader(buffer)
+    ]
+    invalidos = [ano for ano in anos if not ano.isdigit()]
+    if invalidos:
+        return [f"ano_modelo fora do formato inteiro no CSV: {invalidos}"]
+    return []
+
+
+def verificar_banco(fipe_import):
+    from sqlalchemy import text
+
+    eventos = []
+    df, _ = fipe_import.coletar_dados_do_cache()
+    try:
+        fipe_import.copiar_para_o_banco(df, eventos.append)
+    finally:
+        with fipe_import.get_engine().begin() as conn:
+            conn.execute(text("DELETE FROM fipe_carros WHERE codigo_fipe = 'S99999-1'"))
+    if any(evento["event"] == "save_fallback" for evento in eventos):
+        return ["copiar_para_o_banco caiu no fallback em batches"]
+    return []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--banco", action="store_true", help="Tambem grava em fipe_carros via DATABASE_URL")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = Path(pasta) / "fipe_cache.json"
+        caminho.write_text(json.dumps(CACHE), encoding="utf-8")
+        os.environ["FIPE_CACHE_PATH"] = str(caminho)
+        os.environ.setdefault("FIPE_LOG_DIR", pasta)
+        from app.pipeline import fipe_import
+
+        problemas = verificar_csv(fipe_import)
+        if args.banco:
+            problemas += verificar_banco(fipe_import)
+
+    for problema in problemas:
+        print(problema)
+    print("ok" if not problemas else "falhou")
+    return 1 if problemas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())